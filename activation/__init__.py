@@ -1,13 +1,15 @@
-from os.path import dirname, basename, isfile
-import glob
+"""
+The submodules are imported on first access, e.g. activation.relu, instead of
+globbing and importing the whole directory. The types are looked up by name
+through registry.
+"""
 import importlib
-modules = glob.glob(dirname(__file__) + "/*.py")
-__all__ = [
-    basename(f)[:-3]
-    for f in modules
-    if isfile(f) and not f.endswith('__init__.py')
-]
-for module in __all__:
-    __import__("activation.{}".format(module), locals(), globals())
-    # globals().update(importlib.import_module("activation.{}".format(module)).__dict__)
-del module
+
+__all__ = ["relu", "sigmoid"]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module("activation.{}".format(name))
+    raise AttributeError("module 'activation' has no attribute {!r}".format(
+        name))
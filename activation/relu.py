@@ -4,6 +4,8 @@ Defines relu activation function
 
 import numpy as np
 
+import buffers
+
 
 class ReLU(object):
     """
@@ -13,29 +15,83 @@ class ReLU(object):
 
     def __init__(self):
         self.input = None
+        self.workspace = {}
 
     def __repr__(self):
         return "<Activation.ReLU>"
 
     def __call__(self, X):
-        self.input = X
-        return np.maximum(X, 0.0)
+        return self.forward_prop(X)
+
+    def buffer(self, name, shape, dtype, workspace=None):
+        """
+        :returns: The buffers.get array of the given workspace dict, or of
+                  the workspace of the activation.
+        """
+        return buffers.get(self.workspace if workspace is None else workspace,
+                           name, shape, dtype)
 
     def forward_prop(self, X):
         """
         Preforms the forward propagation, saving the necessary data for
-        backward propagation.
+        backward propagation. The result is written to a workspace buffer.
         """
         self.input = X
-        return np.maximum(X, 0.0)
+        return np.maximum(X, 0.0, out=self.buffer('output', X.shape, X.dtype))
+
+    def infer(self, X, out=None, workspace=None):
+        """
+        Inference mode forward propagation, which doesn't keep the input.
+        """
+        return np.maximum(X, 0.0, out=out)
 
     def backward_prop(self, Y):
         """
-        Preforms backward propagation, and chain rule. The new gradient is then
-        returned.
+        Preforms backward propagation, and chain rule. The new gradient is
+        written into Y, which is then returned.
+        """
+        return self.derivative(self.input, Y)
+
+    def derivative(self, X, Y, workspace=None):
+        """
+        Applies the chain rule for the input X to the gradient Y in place,
+        without using any state of the activation.
+        """
+        mask = np.greater_equal(X,
+                                0,
+                                out=self.buffer('mask', X.shape, bool,
+                                                workspace))
+        return np.multiply(Y, mask, out=Y)
+
+    def activate(self, X, workspace=None):
+        """
+        Fused forward propagation, which applies the ReLU to X in place. The
+        gradient is zero exactly where the output is, so the output itself is
+        all the backward propagation needs, and nothing else is kept.
+
+        :returns: The output, which is what chain needs.
+        """
+        return np.maximum(X, 0.0, out=X)
+
+    def chain(self, output, Y, workspace=None):
+        """
+        Fused backward propagation, applying the chain rule to the gradient Y
+        in place with the output from activate. The mask of the positive
+        outputs is a workspace buffer that is only used during the call, and
+        multiplying by it is much faster than a masked copyto.
+        """
+        mask = np.greater(output,
+                          0,
+                          out=self.buffer('mask', output.shape, bool,
+                                          workspace))
+        return np.multiply(Y, mask, out=Y)
+
+    def workspace_bytes(self, shape, dtype):
+        """
+        :returns: Bytes of the workspace buffers activate and chain use for
+                  an input of the given shape and type.
         """
-        Y[self.input < 0] = 0
-        return Y
+        return int(np.prod(shape))
 
     def update_weights(self, count):
         """
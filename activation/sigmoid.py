@@ -4,38 +4,118 @@ Defines sigmoid activation function
 
 import numpy as np
 
+import buffers
+
 
 class Sigmoid(object):
     """
     Sigmoid class to handle the forward and backward propagation of the
     sigmoid non-linearity layers between the linear layers.
+
+    The derivative of the sigmoid only depends on its output, so the output
+    is kept for the backward propagation instead of the input.
     """
 
     def __init__(self):
-        self.input = 0.0
+        self.output = None
+        self.workspace = {}
 
     def __repr__(self):
         return "<Activation.Sigmoid>"
 
     def __call__(self, X):
-        self.input = X
-        return 1.0 / (1.0 - np.exp(-X))
+        return self.forward_prop(X)
+
+    def buffer(self, name, shape, dtype, workspace=None):
+        """
+        :returns: The buffers.get array of the given workspace dict, or of
+                  the workspace of the activation.
+        """
+        return buffers.get(self.workspace if workspace is None else workspace,
+                           name, shape, dtype)
+
+    def evaluate(self, X, out, workspace=None):
+        """
+        Writes the sigmoid of X into out, which may be X itself. Only
+        exp(-|X|) is ever computed, so nothing overflows for large inputs.
+        Positive inputs use 1 / (1 + exp(-x)), and negative inputs use
+        exp(x) / (1 + exp(x)), so both tails keep their precision.
+        """
+        negative = np.less(X, 0, out=self.buffer('negative', X.shape, bool,
+                                                 workspace))
+        exp = np.abs(X, out=self.buffer('exp', X.shape, X.dtype, workspace))
+        np.negative(exp, out=exp)
+        np.exp(exp, out=exp)
+        np.add(exp, 1.0, out=out)
+        np.reciprocal(out, out=out)
+        np.multiply(out, exp, out=out, where=negative)
+        return out
 
     def forward_prop(self, X):
         """
         Preforms the forward propagation, saving the necessary data for
-        backward propagation.
+        backward propagation. The result is written to a workspace buffer.
+        """
+        self.output = self.evaluate(X, self.buffer('output', X.shape,
+                                                   X.dtype))
+        return self.output
+
+    def infer(self, X, out=None, workspace=None):
+        """
+        Inference mode forward propagation, which doesn't keep the output.
+        The temporaries are kept in the given workspace, or allocated for the
+        call, so concurrent calls are safe.
         """
-        self.input = X
-        return 1.0 / (1.0 - np.exp(-X))
+        if out is None:
+            out = np.empty_like(X)
+        return self.evaluate(X, out, {} if workspace is None else workspace)
 
     def backward_prop(self, Y):
         """
-        Preforms backward propagation, and chain rule. The new gradient is then
-        returned.
+        Preforms backward propagation, and chain rule. The new gradient is
+        written into Y, which is then returned.
+        """
+        return self.chain(self.output, Y)
+
+    def derivative(self, X, Y, workspace=None):
+        """
+        Applies the chain rule for the input X to the gradient Y in place,
+        without using any state of the activation.
+        """
+        output = self.evaluate(X, self.buffer('grad', X.shape, X.dtype,
+                                              workspace), workspace)
+        return self.chain(output, Y, workspace)
+
+    def activate(self, X, workspace=None):
+        """
+        Fused forward propagation, which applies the sigmoid to X in place.
+        The output itself is all the backward propagation needs, so nothing
+        else is kept.
+
+        :returns: The output, which is what chain needs.
+        """
+        return self.evaluate(X, X, workspace)
+
+    def chain(self, output, Y, workspace=None):
+        """
+        Fused backward propagation, applying the chain rule to the gradient Y
+        in place with the sigmoid output, as output * (1 - output) * Y.
+        """
+        scratch = np.subtract(1.0,
+                              output,
+                              out=self.buffer('chain', output.shape,
+                                              output.dtype, workspace))
+        Y *= output
+        Y *= scratch
+        return Y
+
+    def workspace_bytes(self, shape, dtype):
+        """
+        :returns: Bytes of the workspace buffers activate and chain use for
+                  an input of the given shape and type, the sign mask and
+                  two float temporaries.
         """
-        return (1.0 - (1.0 / (1.0 - np.exp(-self.input)))) * (
-            1.0 / (1.0 - np.exp(-self.input))) * Y
+        return int(np.prod(shape)) * (1 + 2 * np.dtype(dtype).itemsize)
 
     def update_weights(self, count):
         """
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Measures the startup time of the entry points with python -X importtime and
+checks that the heavy modules are only imported when they are needed.
+
+    python benchmarks/startup.py [--repeat 5] [--budget 0.5] [--json]
+
+Scripts, like main.py, are run end to end and timed by the wall clock of the
+whole process, modules are timed by their cumulative import time. Exits with
+status 1 if a module that should be deferred is imported, or if the median
+time of an entry point is over the budget.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Entry point -> modules it must not import at startup
+DEFERRED = {
+    "main.py": ["multiprocessing", "parallel", "plan", "profiler",
+                "quantize", "urllib.request", "data.mnist", "data.cifar10",
+                "layer.conv2d"],
+    "network": ["multiprocessing", "parallel", "plan", "layer.dense",
+                "activation.relu", "activation.sigmoid", "urllib.request"],
+    "data": ["numpy", "data.mnist", "data.cifar10", "data.pipeline"],
+    "data.mnist": ["urllib.request", "gzip", "shutil", "tarfile"],
+    "data.cifar10": ["urllib.request", "gzip", "shutil", "tarfile"],
+    "data.pipeline": ["urllib.request", "gzip", "shutil", "tarfile"],
+}
+
+
+def importtime(module):
+    """
+    Runs the script, or imports the module, in a fresh interpreter.
+
+    :param module: Path of a .py script relative to the repository, or name
+                   of the module to import.
+    :returns: Tuple of the wall clock time of the script, or the cumulative
+              import time of the module, in seconds, and the dict of every
+              imported module to its cumulative time.
+    """
+    if module.endswith(".py"):
+        command = [module]
+    else:
+        command = ["-c", "import " + module]
+    begin = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime"] + command,
+        cwd=ROOT, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL,
+        universal_newlines=True, check=True)
+    elapsed = time.perf_counter() - begin
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(cumulative) * 1e-6
+    if module.endswith(".py"):
+        return elapsed, modules
+    return modules.get(module, 0.0), modules
+
+
+def measure(module, repeat):
+    """
+    :param module: Script to run or name of the module to import.
+    :param repeat: Number of fresh interpreters to time.
+    :returns: Dict with the median and min time, the number of
+              modules imported, and the deferred modules that were imported.
+    """
+    times = []
+    for _ in range(repeat):
+        seconds, modules = importtime(module)
+        times.append(seconds)
+    return {
+        "median": statistics.median(times),
+        "min": min(times),
+        "modules": len(modules),
+        "eager": [name for name in DEFERRED.get(module, [])
+                  if name in modules],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("modules", nargs="*", default=sorted(DEFERRED),
+                        help="Scripts to run or modules to import")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=0.5,
+                        help="Largest median time in seconds")
+    parser.add_argument("--json", action="store_true",
+                        help="Print the results as JSON")
+    args = parser.parse_args()
+
+    results = {module: measure(module, args.repeat)
+               for module in args.modules}
+    failed = [module for module, result in results.items()
+              if result["eager"] or result["median"] > args.budget]
+    if args.json:
+        print(json.dumps({"budget": args.budget, "results": results,
+                          "failed": failed}, indent=2))
+    else:
+        for module, result in results.items():
+            print("{:<16} {:8.1f} ms median {:8.1f} ms min {:4d} modules{}"
+                  .format(module, result["median"] * 1e3,
+                          result["min"] * 1e3, result["modules"],
+                          "  eager: " + ", ".join(result["eager"])
+                          if result["eager"] else ""))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
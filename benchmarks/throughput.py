@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Benchmarks training and inference throughput on synthetic data, so nothing
+has to be downloaded.
+
+    python benchmarks/throughput.py [--quick] [--output results.json]
+                                    [--compare baseline.json]
+
+For every combination of the widths, depths, batch sizes and dtypes it
+measures the samples/sec of Network.train, of train with the compiled plan
+and of Network.predict, and the peak memory of training and predicting. It
+also times the forward and backward propagation of Dense, ReLU and Sigmoid on
+their own, and the samples/sec and peak memory of a Pipeline epoch from memory
+and from a memory mapped .npy file. The results are written as JSON, and
+another run can be given with --compare to report the regressions.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+
+from activation.relu import ReLU  # noqa: E402
+from activation.sigmoid import Sigmoid  # noqa: E402
+from data.pipeline import Pipeline  # noqa: E402
+from layer.dense import Dense  # noqa: E402
+from layer.input import Input  # noqa: E402
+from loss.softmax import Softmax  # noqa: E402
+from network import Network  # noqa: E402
+
+FEATURES = 784
+CLASSES = 10
+
+# Metrics where larger is better, every other metric is a time or a size
+HIGHER = ("samples_per_sec", )
+
+
+def per_call(function, setup=None, repeat=20, warmup=2):
+    """
+    Times the function on its own, with the setup run untimed before every
+    call.
+
+    :param function: Function without arguments to time.
+    :param setup: Function without arguments run before every call.
+    :param repeat: Number of timed calls.
+    :param warmup: Number of untimed calls first, to allocate the buffers.
+    :returns: Median seconds per call.
+    """
+    times = []
+    for index in range(warmup + repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        if index >= warmup:
+            times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def peak_memory(function):
+    """
+    :param function: Function without arguments to run once.
+    :returns: Peak bytes allocated through python and NumPy while it runs.
+    """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def synthetic(samples, dtype, seed=0):
+    """
+    :returns: Tuple of (samples, FEATURES) inputs and the label indices of a
+              random linear model of them.
+    """
+    rng = np.random.RandomState(seed)
+    X = rng.standard_normal((samples, FEATURES)).astype(dtype)
+    Y = (X @ rng.standard_normal((FEATURES, CLASSES))).argmax(axis=1)
+    return X, Y
+
+
+def build(width, depth, dtype):
+    """
+    :returns: Network of depth ReLU layers of width neurons, and a linear
+              output layer.
+    """
+    np.random.seed(0)
+    nn = Network(loss_function=Softmax(), dtype=dtype)
+    nn.add_layer("input", shape=FEATURES)
+    for _ in range(depth):
+        nn.add_layer("dense", neurons=width, activation="relu")
+    nn.add_layer("dense", neurons=CLASSES)
+    return nn
+
+
+def network_case(width, depth, batch_size, dtype, samples, repeat):
+    """
+    :returns: Metrics of training and predicting with one network.
+    """
+    X, Y = synthetic(samples, dtype)
+    starts = range(0, samples - batch_size + 1, batch_size)
+
+    def epoch(nn):
+        for start in starts:
+            nn.train(X[start:start + batch_size], Y[start:start + batch_size])
+
+    nn = build(width, depth, dtype)
+    train = per_call(lambda: epoch(nn), repeat=repeat, warmup=1)
+    nn.compile(batch_size)
+    compiled = per_call(lambda: epoch(nn), repeat=repeat, warmup=1)
+    predict = per_call(lambda: nn.predict(X), repeat=repeat, warmup=1)
+    nn = build(width, depth, dtype)
+    trained = len(starts) * batch_size
+    return {
+        "train": {"samples_per_sec": trained / train},
+        "train_compiled": {"samples_per_sec": trained / compiled},
+        "predict": {"samples_per_sec": samples / predict},
+        "train_peak_bytes": peak_memory(lambda: epoch(nn)),
+        "predict_peak_bytes": peak_memory(lambda: nn.predict(X)),
+    }
+
+
+def layer_cases(width, batch_size, dtype, repeat):
+    """
+    :returns: Dict of layer name to the median forward and backward seconds
+              per batch. Dense is timed without an activation, and the
+              activate and chain of both activations on a (batch_size,
+              width) input.
+    """
+    rng = np.random.RandomState(0)
+    X = rng.standard_normal((batch_size, width)).astype(dtype)
+    dD = rng.standard_normal((batch_size, width)).astype(dtype)
+    grad = np.empty_like(dD)
+
+    def refresh():
+        np.copyto(grad, dD)
+
+    source = Input(width, dtype=dtype)
+    source.load_data(X)
+    dense = Dense(source, width, dtype=dtype)
+    results = {
+        "dense": {
+            "forward_sec": per_call(dense.forward_prop, repeat=repeat),
+            "backward_sec": per_call(lambda: dense.backward_prop(grad),
+                                     refresh, repeat),
+        }
+    }
+    # The activations are timed through activate and chain, which are what
+    # Dense runs, on a fresh copy of the input as they work in place
+    inputs = np.empty_like(X)
+
+    def reload():
+        np.copyto(inputs, X)
+
+    for name, kind in (("relu", ReLU), ("sigmoid", Sigmoid)):
+        activation = kind()
+        reload()
+        saved = activation.activate(inputs)
+        results[name] = {
+            "forward_sec": per_call(lambda: activation.activate(inputs),
+                                    reload, repeat),
+            "backward_sec": per_call(
+                lambda: activation.chain(saved, grad), refresh, repeat),
+        }
+    return results
+
+
+def loader_cases(samples, batch_size, dtype, directory):
+    """
+    :returns: Dict of source to the samples/sec and peak memory of a Pipeline
+              epoch over uint8 images, scaled and converted to dtype.
+    """
+    rng = np.random.RandomState(0)
+    X = rng.randint(0, 256, (samples, FEATURES), dtype=np.uint8)
+    Y = rng.randint(0, CLASSES, samples)
+    path = os.path.join(directory, "x.npy")
+    np.save(path, X)
+    sources = {"memory": X, "mmap": np.load(path, mmap_mode="r")}
+    results = {}
+    for name, data in sources.items():
+        pipeline = Pipeline(data, Y, batch_size=batch_size, dtype=dtype,
+                            scale=1.0 / 256.0)
+
+        def epoch():
+            for _ in pipeline:
+                pass
+
+        results[name] = {
+            "samples_per_sec": samples / per_call(epoch, repeat=3, warmup=1),
+            "peak_bytes": peak_memory(epoch),
+        }
+    return results
+
+
+def environment():
+    """
+    :returns: Dict describing the machine and the revision benchmarked.
+    """
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True).stdout.strip()
+    except OSError:
+        revision = ""
+    return {
+        "revision": revision,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def run(args):
+    """
+    :returns: Dict with the environment, the grid and a list of results,
+              each with the configuration and its metrics.
+    """
+    results = []
+    for dtype in args.dtypes:
+        for batch_size in args.batch_sizes:
+            for width in args.widths:
+                config = {"width": width, "batch_size": batch_size,
+                          "dtype": dtype}
+                for name, metrics in layer_cases(width, batch_size, dtype,
+                                                 args.repeat).items():
+                    results.append(dict(config, kind="layer", layer=name,
+                                        metrics=metrics))
+                for depth in args.depths:
+                    log(args, "network", dict(config, depth=depth))
+                    results.append(dict(
+                        config, kind="network", depth=depth,
+                        metrics=network_case(width, depth, batch_size, dtype,
+                                             args.samples, args.repeat)))
+            with tempfile.TemporaryDirectory() as directory:
+                for name, metrics in loader_cases(args.samples, batch_size,
+                                                  dtype, directory).items():
+                    results.append({"kind": "loader", "source": name,
+                                    "batch_size": batch_size, "dtype": dtype,
+                                    "metrics": metrics})
+    return {
+        "environment": environment(),
+        "grid": {"widths": args.widths, "depths": args.depths,
+                 "batch_sizes": args.batch_sizes, "dtypes": args.dtypes,
+                 "samples": args.samples, "repeat": args.repeat},
+        "results": results,
+    }
+
+
+def flatten(metrics, prefix=""):
+    """
+    :returns: Dict of dotted metric name to value.
+    """
+    flat = {}
+    for name, value in metrics.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + name + "."))
+        else:
+            flat[prefix + name] = value
+    return flat
+
+
+def key(result):
+    return tuple(sorted((name, value) for name, value in result.items()
+                        if name != "metrics"))
+
+
+def compare(baseline, current, tolerance):
+    """
+    :param baseline: Results of an earlier run.
+    :param current: Results of this run.
+    :param tolerance: Relative change allowed before it counts, e.g. 0.1.
+    :returns: List of (configuration, metric, old, new) of every metric that
+              got worse by more than the tolerance.
+    """
+    old = {key(result): flatten(result["metrics"])
+           for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        before = old.get(key(result))
+        if before is None:
+            continue
+        for metric, value in flatten(result["metrics"]).items():
+            if metric not in before or not before[metric]:
+                continue
+            ratio = value / before[metric]
+            if metric.endswith(HIGHER):
+                worse = ratio < 1.0 - tolerance
+            else:
+                worse = ratio > 1.0 + tolerance
+            if worse:
+                regressions.append((dict(key(result)), metric, before[metric],
+                                    value))
+    return regressions
+
+
+def log(args, *values):
+    if args.verbose:
+        print(*values, file=sys.stderr)
+
+
+def integers(text):
+    return [int(value) for value in text.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--widths", type=integers, default=[64, 256, 1024])
+    parser.add_argument("--depths", type=integers, default=[1, 2, 4])
+    parser.add_argument("--batch-sizes", type=integers, default=[32, 256])
+    parser.add_argument("--dtypes", type=lambda text: text.split(","),
+                        default=["float32", "float64"])
+    parser.add_argument("--samples", type=int, default=4096,
+                        help="Synthetic samples per measurement")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Timed repetitions, the median is reported")
+    parser.add_argument("--quick", action="store_true",
+                        help="Small grid for a smoke test")
+    parser.add_argument("--output", help="JSON file for the results, "
+                        "printed to stdout by default")
+    parser.add_argument("--compare", help="JSON file of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Relative slowdown reported by --compare")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    if args.quick:
+        args.widths, args.depths, args.batch_sizes = [64], [1, 2], [64]
+        args.samples, args.repeat = 1024, 3
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as results_out:
+            results_out.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as baseline_in:
+            regressions = compare(json.load(baseline_in), report,
+                                  args.tolerance)
+        for config, metric, before, after in regressions:
+            print("regression {} {}: {:.6g} -> {:.6g}".format(
+                config, metric, before, after), file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,26 @@
+"""
+Defines the workspace buffers the layers, activations and losses reuse
+between calls
+"""
+import numpy as np
+
+
+def get(workspace, name, shape, dtype):
+    """
+    Returns the workspace array for the given name and shape, allocating it
+    only the first time it is requested. Buffers are kept for every shape, so
+    steady-state training doesn't allocate.
+
+    :param workspace: Dict holding the buffers, usually the workspace of the
+                      object asking for it, or of an inference context.
+    :param name: Name of the buffer.
+    :param shape: Shape of the buffer.
+    :param dtype: Type of the buffer.
+    :returns: The uninitialized buffer.
+    """
+    key = (name, shape, np.dtype(dtype))
+    buf = workspace.get(key)
+    if buf is None:
+        buf = np.empty(shape, dtype=dtype)
+        workspace[key] = buf
+    return buf
@@ -1,12 +1,14 @@
-from os.path import dirname, basename, isfile
-import glob
-modules = glob.glob(dirname(__file__) + "/*.py")
-__all__ = [
-    basename(f)[:-3]
-    for f in modules
-    if isfile(f) and not f.endswith('__init__.py')
-]
-for module in __all__:
-    __import__("data.{}".format(module), locals(), globals())
-del module
+"""
+The submodules are imported on first access, e.g. data.mnist, instead of
+globbing and importing the whole directory, so using the cached data does not
+pull in the download code.
+"""
+import importlib
 
+__all__ = ["cifar10", "labels", "mnist", "pipeline", "sparse"]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module("data.{}".format(name))
+    raise AttributeError("module 'data' has no attribute {!r}".format(name))
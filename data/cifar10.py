@@ -2,11 +2,12 @@
 This module is used to download, extract, load, and delete the CIFAR10 dataset.
 """
 import os
-import shutil
-import tarfile
-import urllib.request
 import numpy as np
 
+from data.labels import one_hot, indices
+
+CACHE_DIR = './data/CIFAR10/cache'
+
 
 def download_and_extract(verbose=True):
     """
@@ -14,6 +15,9 @@ def download_and_extract(verbose=True):
 
     :param verbose: Toggles verbose printing
     """
+    import shutil
+    import tarfile
+    import urllib.request
     dest = './data/CIFAR10'
     url = 'https://www.cs.toronto.edu/~kriz/cifar-10-python.tar.gz'
     filename = url.split('/')[-1]
@@ -69,6 +73,7 @@ def delete(verbose=True):
 
     :param verbose: Toggles verbose printing
     """
+    import shutil
     dest = './data/CIFAR10'
     if os.path.exists(dest):
         if verbose:
@@ -92,43 +97,169 @@ def unpickle(file):
     return None
 
 
-def load(file, scores=False, flatten=False, verbose=True):
+def cache(verbose=True):
+    """
+    Converts the pickled CIFAR10 batches into a pair of .npy files, the
+    flattened images as uint8 and the labels as int64, so later loads can
+    memory map them. The five training batches come first, followed by the
+    test batch. The conversion is only done once, the existing files are
+    reused after that.
+
+    :param verbose: Toggles verbose printing
+    :returns: The paths of the image and label files
+    """
+    x_path = os.path.join(CACHE_DIR, 'x.npy')
+    y_path = os.path.join(CACHE_DIR, 'y.npy')
+    if os.path.exists(x_path) and os.path.exists(y_path):
+        return x_path, y_path
+    download_and_extract(verbose)
+    if verbose:
+        print(">> Caching {}".format(CACHE_DIR))
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    source_dir = './data/CIFAR10/'
+    x_data = np.empty((60000, 3072), dtype=np.uint8)
+    y_data = np.empty(60000, dtype=np.int64)
+    files = ["data_batch_{}".format(i) for i in range(1, 6)] + ["test_batch"]
+    for i, file in enumerate(files):
+        data_dict = unpickle(os.path.join(source_dir, file))
+        x_data[i * 10000:(i + 1) * 10000] = data_dict[b'data']
+        y_data[i * 10000:(i + 1) * 10000] = data_dict[b'labels']
+    for path, array in ((x_path, x_data), (y_path, y_data)):
+        with open(path + '.tmp', 'wb') as binary_out:
+            np.save(binary_out, array)
+        os.replace(path + '.tmp', path)
+    if verbose:
+        print("   Successfully cached {}".format(CACHE_DIR))
+    return x_path, y_path
+
+
+def load_cache(verbose=True):
+    """
+    Opens the cached CIFAR10 data set read-only with np.load(mmap_mode='r'),
+    creating the cache first if needed. Nothing is read until it is used,
+    and processes opening the same files share the pages.
+
+    :param verbose: Toggles verbose printing
+    :returns: The flattened uint8 images and int64 labels of all the batches
+    """
+    x_path, y_path = cache(verbose)
+    return np.load(x_path, mmap_mode='r'), np.load(y_path, mmap_mode='r')
+
+
+def convert(x_data, dtype=None, raw=False):
+    """
+    Converts uint8 images, from the cache or the pickled batches, to dtype,
+    float64 by default, or leaves them as they are if raw is set.
+    """
+    if raw:
+        return x_data
+    return np.asarray(x_data).astype(dtype or "float")
+
+
+def cache_index(file):
+    """
+    Finds the position of a data batch in the cache.
+
+    :param file: Specifies the training batch, or some other data batch.
+    :returns: Index of the batch, or None if the batch isn't cached.
+    """
+    if isinstance(file, int):
+        return file - 1 if 1 <= file <= 5 else None
+    if file == "test_batch":
+        return 5
+    if file.startswith("data_batch_") and file[11:] in ("1", "2", "3", "4",
+                                                        "5"):
+        return int(file[11:]) - 1
+    return None
+
+
+def load(file,
+         scores=False,
+         flatten=False,
+         verbose=True,
+         dtype=None,
+         mmap=False,
+         raw=False):
     """
     Loads a CIFAR10 data file, and parses the binary into two numpy.ndarrays.
 
     :param file: Specifies the training batch, or some other data batch.
+    :param scores: Returns the labels as one-hot scores, otherwise they are
+                   int64 class indices, which the loss takes directly
+                   without building the one-hot matrix.
     :param verbose: Toggles verbose printing.
+    :param dtype: Type of the input data and one-hot scores, defaults to
+                  float64.
+    :param mmap: Loads the data from the memory mapped cache, converted the
+                 same way as the pickled batches.
+    :param raw: Returns the images as uint8 pixels instead, which are
+                read-only views of the cache with mmap.
     :returns: A pair of data, the first is the input data, and the second is
               the matching labels.
     """
-    download_and_extract(verbose)
-    if isinstance(file, int):
-        abs_file = os.path.abspath("./data/CIFAR10/data_batch_{}".format(file))
+    if mmap:
+        index = cache_index(file)
+        if index is None:
+            raise ValueError("{} is not a cached CIFAR10 batch".format(file))
+        x_all, y_all = load_cache(verbose)
+        x_data = x_all[index * 10000:(index + 1) * 10000]
+        y_raw = y_all[index * 10000:(index + 1) * 10000]
+        x_data = convert(x_data, dtype, raw)
     else:
-        abs_file = os.path.abspath("./data/CIFAR10/{}".format(file))
-    data_dict = unpickle(abs_file)
-    x_data = np.asarray(data_dict[b'data']).astype("float")
-    y_raw = np.asarray(data_dict[b'labels'])
+        download_and_extract(verbose)
+        if isinstance(file, int):
+            abs_file = os.path.abspath(
+                "./data/CIFAR10/data_batch_{}".format(file))
+        else:
+            abs_file = os.path.abspath("./data/CIFAR10/{}".format(file))
+        data_dict = unpickle(abs_file)
+        x_data = convert(data_dict[b'data'], dtype, raw)
+        y_raw = np.asarray(data_dict[b'labels'])
     if not flatten:
         x_data = x_data.reshape([-1, 3, 32, 32]).transpose([0, 2, 3, 1])
     if scores:
-        y_data = np.zeros((10000, 10))
-        for i in range(10000):
-            y_data[i, y_raw[i]] = 1.0
+        y_data = one_hot(y_raw, 10, dtype)
     else:
-        y_data = y_raw.T
+        y_data = indices(y_raw)
     return x_data, y_data
 
 
-def load_all(scores=False, flatten=False, verbose=True):
+def load_all(scores=False,
+             flatten=False,
+             verbose=True,
+             dtype=None,
+             mmap=False,
+             raw=False):
     """
     Loads the CIFAR10 data set, splitting into training and testing data sets.
+    :param scores: Returns the labels as one-hot scores, otherwise they are
+                   int64 class indices, which the loss takes directly
+                   without building the one-hot matrix.
     :param verbose: Toggles verbose printing.
+    :param dtype: Type of the input data and one-hot scores, defaults to
+                  float64.
+    :param mmap: Loads the data from the memory mapped cache, converted the
+                 same way as the pickled batches.
+    :param raw: Returns the images as uint8 pixels instead. With mmap they
+                are read-only views of the cache, and nothing is
+                concatenated.
     :returns: Four sets of data, the first is the input training data, and
               the second is the matching training labels, then the third is
               the input testing data, and the fourth is the output testing
               labels.
     """
+    if mmap:
+        x_all, y_all = load_cache(verbose)
+        x_data = convert(x_all[:50000], dtype, raw)
+        x_test = convert(x_all[50000:], dtype, raw)
+        if not flatten:
+            x_data = x_data.reshape(-1, 3, 32, 32).transpose(0, 2, 3, 1)
+            x_test = x_test.reshape(-1, 3, 32, 32).transpose(0, 2, 3, 1)
+        y_data, y_test = y_all[:50000], y_all[50000:]
+        if scores:
+            y_data = one_hot(y_data, 10, dtype)
+            y_test = one_hot(y_test, 10, dtype)
+        return x_data, y_data, x_test, y_test
     download_and_extract(verbose)
     source_dir = './data/CIFAR10/'
     x_data = []
@@ -136,31 +267,27 @@ def load_all(scores=False, flatten=False, verbose=True):
     for i in range(1, 6):
         data_dict = unpickle(
             os.path.join(source_dir, "data_batch_{}".format(i)))
-        x_tmp = np.asarray(data_dict[b'data']).astype("float")
+        x_tmp = convert(data_dict[b'data'], dtype, raw)
         y_raw = np.asarray(data_dict[b'labels'])
         if not flatten:
             x_tmp = x_tmp.reshape(10000, 3, 32, 32).transpose(0, 2, 3, 1)
         if scores:
-            y_tmp = np.zeros((10000, 10))
-            for j in range(10000):
-                y_tmp[j, y_raw[j]] = 1.0
+            y_tmp = one_hot(y_raw, 10, dtype)
         else:
-            y_tmp = y_raw.T
+            y_tmp = indices(y_raw)
         x_data.append(x_tmp)
         y_data.append(y_tmp)
     x_data = np.concatenate(x_data)
     y_data = np.concatenate(y_data)
     data_dict = unpickle(os.path.join(source_dir, "test_batch"))
-    x_test = np.asarray(data_dict[b'data']).astype("float")
+    x_test = convert(data_dict[b'data'], dtype, raw)
     if not flatten:
         x_test = x_test.reshape(10000, 3, 32, 32).transpose(0, 2, 3, 1)
     y_raw = np.asarray(data_dict[b'labels'])
     if scores:
-        y_test = np.zeros((10000, 10))
-        for j in range(10000):
-            y_test[j, y_raw[j]] = 1.0
+        y_test = one_hot(y_raw, 10, dtype)
     else:
-        y_test = y_raw.T
+        y_test = indices(y_raw)
     return x_data, y_data, x_test, y_test
 
 
@@ -0,0 +1,32 @@
+"""
+This module is used to encode the class labels of the data sets.
+"""
+import numpy as np
+
+
+def one_hot(labels, classes=10, dtype=None):
+    """
+    Encodes integer class labels as one-hot score vectors, in a single
+    vectorized scatter.
+
+    :param labels: Array like of integer class labels.
+    :param classes: Number of classes, which is the width of the scores.
+    :param dtype: Type of the scores, defaults to float64.
+    :returns: A (samples, classes) array, with a one at the class of every
+              sample and zeros everywhere else.
+    """
+    labels = np.asarray(labels)
+    scores = np.zeros((labels.size, classes), dtype=dtype)
+    scores[np.arange(labels.size), labels.ravel()] = 1.0
+    return scores
+
+
+def indices(labels):
+    """
+    Converts class labels to a contiguous int64 array of class indices, which
+    is the compact form of the labels the loss functions take directly.
+
+    :param labels: Array like of integer class labels.
+    :returns: A 1-D int64 array of the labels.
+    """
+    return np.ascontiguousarray(labels, dtype=np.int64).ravel()
@@ -2,11 +2,14 @@
 This module is used to download, extract, load, and delete the MNIST dataset.
 """
 import os
-import shutil
-import urllib.request
-import gzip
 import numpy as np
 
+from data.labels import one_hot, indices
+
+CACHE_DIR = './data/MNIST/cache'
+# Sample ranges of the training, validation, and testing sets in the cache
+SPLITS = [(0, 50000), (50000, 60000), (60000, 70000)]
+
 
 def download_and_extract(verbose=True):
     """
@@ -14,6 +17,9 @@ def download_and_extract(verbose=True):
 
     :param verbose: Toggles verbose printing
     """
+    import gzip
+    import shutil
+    import urllib.request
     dest = './data/MNIST'
     url = 'http://deeplearning.net/data/mnist/mnist.pkl.gz'
     filename = url.split('/')[-1]
@@ -62,6 +68,7 @@ def delete(verbose=True):
 
     :param verbose: Toggles verbose printing
     """
+    import shutil
     dest = './data/MNIST'
     if os.path.exists(dest):
         if verbose:
@@ -85,17 +92,105 @@ def unpickle(file):
     return None
 
 
-def load(file, scores=False, flatten=False, verbose=True):
+def cache(verbose=True):
+    """
+    Converts the pickled MNIST data set into a pair of .npy files, the images
+    as uint8 and the labels as int64, so later loads can memory map them. The
+    conversion is only done once, the existing files are reused after that.
+    The pickled images are stored as pixel / 256, so the uint8 values are the
+    original pixels.
+
+    :param verbose: Toggles verbose printing
+    :returns: The paths of the image and label files
+    """
+    x_path = os.path.join(CACHE_DIR, 'x.npy')
+    y_path = os.path.join(CACHE_DIR, 'y.npy')
+    if os.path.exists(x_path) and os.path.exists(y_path):
+        return x_path, y_path
+    download_and_extract(verbose)
+    if verbose:
+        print(">> Caching {}".format(CACHE_DIR))
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    train, valid, test = unpickle('./data/MNIST/mnist.pkl')
+    x_data = to_pixels(np.concatenate([train[0], valid[0], test[0]]))
+    y_data = np.concatenate([train[1], valid[1], test[1]]).astype(np.int64)
+    for path, array in ((x_path, x_data), (y_path, y_data)):
+        with open(path + '.tmp', 'wb') as binary_out:
+            np.save(binary_out, array)
+        os.replace(path + '.tmp', path)
+    if verbose:
+        print("   Successfully cached {}".format(CACHE_DIR))
+    return x_path, y_path
+
+
+def load_cache(verbose=True):
+    """
+    Opens the cached MNIST data set read-only with np.load(mmap_mode='r'),
+    creating the cache first if needed. Nothing is read until it is used,
+    and processes opening the same files share the pages.
+
+    :param verbose: Toggles verbose printing
+    :returns: The uint8 images and int64 labels of all the data sets, in
+              training, validation, testing order
+    """
+    x_path, y_path = cache(verbose)
+    return np.load(x_path, mmap_mode='r'), np.load(y_path, mmap_mode='r')
+
+
+def to_pixels(x_data):
+    """
+    Converts pickled images, which are stored as pixel / 256, back to the
+    original uint8 pixels.
+    """
+    return np.clip(np.rint(x_data * 256.0), 0, 255).astype(np.uint8)
+
+
+def from_cache(x_data, dtype=None, raw=False):
+    """
+    Converts cached uint8 images to dtype, float32 by default, with the same
+    scale as the pickled data set, or leaves them as they are if raw is set.
+    """
+    if raw:
+        return x_data
+    return np.multiply(x_data, 1.0 / 256.0, dtype=dtype or np.float32)
+
+
+def from_pickle(x_data, dtype=None, raw=False):
+    """
+    Converts pickled images to dtype, or to uint8 pixels if raw is set.
+    """
+    if raw:
+        return to_pixels(x_data)
+    if dtype is not None:
+        return x_data.astype(dtype, copy=False)
+    return x_data
+
+
+def load(file,
+         scores=False,
+         flatten=False,
+         verbose=True,
+         dtype=None,
+         mmap=False,
+         raw=False):
     """
     Loads a MNIST data file, and parses the binary into two numpy.ndarrays.
 
     :param file: Specifies validation or training or testing data set to load.
+    :param scores: Returns the labels as one-hot scores, otherwise they are
+                   int64 class indices, which the loss takes directly
+                   without building the one-hot matrix.
     :param verbose: Toggles verbose printing.
+    :param dtype: Type of the input data and one-hot scores, by default the
+                  input data is float32 pixel / 256, as stored in the pickled
+                  data set, and the scores are float64.
+    :param mmap: Loads the data from the memory mapped cache, scaled the
+                 same way as the pickled data.
+    :param raw: Returns the images as uint8 pixels instead, which are
+                read-only views of the cache with mmap.
     :returns: A pair of data, the first is the input data, and the second is
               the matching labels.
     """
-    download_and_extract(verbose)
-    abs_file = os.path.abspath('./data/MNIST/mnist.pkl')
     data_set = 0
     if isinstance(file, int):
         data_set = file
@@ -106,56 +201,86 @@ def load(file, scores=False, flatten=False, verbose=True):
             data_set = 2
         else:
             data_set = 0
-    train, valid, test = unpickle(abs_file)
     x_data = None
     y_data = None
-    if data_set == 0:
-        x_data, y_raw = train
-    elif data_set == 1:
-        x_data, y_raw = valid
-    elif data_set == 2:
-        x_data, y_raw = test
+    if mmap:
+        x_all, y_all = load_cache(verbose)
+        start, stop = SPLITS[data_set]
+        x_data = from_cache(x_all[start:stop], dtype, raw)
+        y_raw = y_all[start:stop]
+    else:
+        download_and_extract(verbose)
+        abs_file = os.path.abspath('./data/MNIST/mnist.pkl')
+        train, valid, test = unpickle(abs_file)
+        if data_set == 0:
+            x_data, y_raw = train
+        elif data_set == 1:
+            x_data, y_raw = valid
+        elif data_set == 2:
+            x_data, y_raw = test
+        x_data = from_pickle(x_data, dtype, raw)
     if not flatten:
         x_data = x_data.reshape([-1, 28, 28])
     if scores:
-        y_data = np.zeros((np.size(x_data, 0), 10))
-        for i in range(np.size(x_data, 0)):
-            y_data[y_raw[i], i] = 1.0
+        y_data = one_hot(y_raw, 10, dtype)
     else:
-        y_data = y_raw.T
+        y_data = indices(y_raw)
     return x_data, y_data
 
 
-def load_all(scores=False, flatten=False, verbose=True):
+def load_all(scores=False,
+             flatten=False,
+             verbose=True,
+             dtype=None,
+             mmap=False,
+             raw=False):
     """
     Loads the MNIST data set, splitting into training and testing data sets.
+    :param scores: Returns the labels as one-hot scores, otherwise they are
+                   int64 class indices, which the loss takes directly
+                   without building the one-hot matrix.
     :param verbose: Toggles verbose printing.
+    :param dtype: Type of the input data and one-hot scores, by default the
+                  input data is float32 pixel / 256, as stored in the pickled
+                  data set, and the scores are float64.
+    :param mmap: Loads the data from the memory mapped cache, scaled the
+                 same way as the pickled data.
+    :param raw: Returns the images as uint8 pixels instead, which are
+                read-only views of the cache with mmap.
     :returns: Four sets of data, the first is the input training data, and the
               second is the matching training labels, then the third is the
               input testing data, and the fourth is the output testing labels.
     """
-    download_and_extract(verbose)
-    source_dir = './data/MNIST/mnist.pkl'
-    train, valid, test = unpickle(source_dir)
-    x_data = np.concatenate([train[0], valid[0]])
+    if mmap:
+        x_all, y_all = load_cache(verbose)
+        split = SPLITS[2][0]
+        x_data = from_cache(x_all[:split], dtype, raw)
+        y_raw = y_all[:split]
+    else:
+        download_and_extract(verbose)
+        source_dir = './data/MNIST/mnist.pkl'
+        train, valid, test = unpickle(source_dir)
+        x_data = from_pickle(np.concatenate([train[0], valid[0]]), dtype,
+                             raw)
+        y_raw = np.concatenate([train[1], valid[1]])
     if not flatten:
         x_data = x_data.reshape([-1, 28, 28])
-    y_raw = np.concatenate([train[1], valid[1]])
     if scores:
-        y_data = np.zeros((np.size(x_data, 0), 10))
-        for i in range(np.size(x_data, 0)):
-            y_data[i, y_raw[i]] = 1.0
+        y_data = one_hot(y_raw, 10, dtype)
+    else:
+        y_data = indices(y_raw)
+    if mmap:
+        x_test = from_cache(x_all[split:], dtype, raw)
+        y_raw = y_all[split:]
     else:
-        y_data = y_raw.T
-    x_test, y_raw = test
+        x_test, y_raw = test
+        x_test = from_pickle(x_test, dtype, raw)
     if not flatten:
         x_test = x_test.reshape([-1, 28, 28])
     if scores:
-        y_test = np.zeros((np.size(x_test, 0), 10))
-        for i in range(np.size(x_test, 0)):
-            y_test[i, y_raw[i]] = 1.0
+        y_test = one_hot(y_raw, 10, dtype)
     else:
-        y_test = y_raw.T
+        y_test = indices(y_raw)
     return x_data, y_data, x_test, y_test
 
 def view(img, index=None):
@@ -0,0 +1,196 @@
+"""
+This module is used to stream shuffled mini-batches from the data sets, with
+the transforms applied per batch on a background thread.
+"""
+import queue
+import threading
+import numpy as np
+
+from data import mnist, cifar10
+
+
+class Pipeline(object):
+    """
+    Pipeline class that yields (x_batch, y_batch) pairs for one epoch every
+    time it is iterated. The data is never copied or transformed as a whole,
+    each batch is gathered by index, converted, scaled, normalized, flattened
+    and augmented on its own. A background thread prepares the next batches
+    while the current one is being used, so works well with memory mapped
+    data from the loaders.
+    """
+
+    def __init__(self,
+                 X,
+                 Y=None,
+                 batch_size=32,
+                 shuffle=True,
+                 dtype=np.float64,
+                 scale=None,
+                 mean=None,
+                 std=None,
+                 flatten=False,
+                 augment=None,
+                 prefetch=2):
+        """
+        :param X: Input data, with the samples along the first axis.
+        :param Y: Matching labels, with the samples along the first axis.
+        :param batch_size: Number of samples per batch.
+        :param shuffle: Toggles reshuffling of the samples every epoch.
+        :param dtype: Type the input batches are converted to.
+        :param scale: Factor the input batches are multiplied by.
+        :param mean: Mean subtracted from the scaled input batches.
+        :param std: Standard deviation the input batches are divided by.
+        :param flatten: Flattens every sample of the input batches.
+        :param augment: Function called with every input batch, returning the
+                        augmented batch.
+        :param prefetch: Number of batches prepared ahead, 0 prepares them on
+                         the calling thread.
+        """
+        self.X = X
+        self.Y = Y
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.dtype = np.dtype(dtype)
+        self.scale = scale
+        self.mean = mean
+        self.std = std
+        self.flatten = flatten
+        self.augment = augment
+        self.prefetch = prefetch
+
+    def __repr__(self):
+        return "<Data.Pipeline {},{}>".format(len(self.X), self.batch_size)
+
+    def __len__(self):
+        return -(-len(self.X) // self.batch_size)
+
+    def __iter__(self):
+        if self.prefetch <= 0:
+            return self.batches()
+        return self.prefetched()
+
+    def transform(self, x_batch):
+        """
+        Applies the conversion and transforms to a single input batch, which
+        is modified in place when it already has the right type.
+        """
+        x_batch = np.asarray(x_batch, dtype=self.dtype)
+        if self.scale is not None:
+            x_batch *= self.scale
+        if self.mean is not None:
+            x_batch -= self.mean
+        if self.std is not None:
+            x_batch /= self.std
+        if self.flatten:
+            x_batch = x_batch.reshape(len(x_batch), -1)
+        if self.augment is not None:
+            x_batch = self.augment(x_batch)
+        return x_batch
+
+    def batches(self):
+        """
+        Generator yielding the batches of one epoch on the calling thread.
+        """
+        count = len(self.X)
+        order = np.random.permutation(count) if self.shuffle else None
+        for start in range(0, count, self.batch_size):
+            stop = min(start + self.batch_size, count)
+            if order is None:
+                # Slices are views of X, so they are copied before being
+                # transformed in place
+                x_batch = np.array(self.X[start:stop], dtype=self.dtype)
+                y_batch = None if self.Y is None else self.Y[start:stop]
+            else:
+                index = np.sort(order[start:stop])
+                x_batch = np.take(self.X, index, axis=0)
+                y_batch = None if self.Y is None else np.take(
+                    self.Y, index, axis=0)
+            yield self.transform(x_batch), y_batch
+
+    def prefetched(self):
+        """
+        Generator yielding the batches of one epoch, which are prepared on a
+        background thread up to prefetch batches ahead.
+        """
+        batches = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            """
+            Puts item on the queue, unless the consumer stops first.
+
+            :returns: Whether the item was put.
+            """
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for batch in self.batches():
+                    if not put(batch):
+                        return
+                put(done)
+            except Exception as err:
+                put(err)
+
+        worker = threading.Thread(target=produce, daemon=True)
+        worker.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is done:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            worker.join()
+
+
+def mnist_pipeline(file='training', verbose=True, **kwargs):
+    """
+    Creates a pipeline over the memory mapped MNIST data set, scaled to the
+    same range as the pickled data.
+
+    :param file: Specifies validation or training or testing data set to load.
+    :param verbose: Toggles verbose printing.
+    :returns: Pipeline over the data set, the other keyword arguments are
+              passed on to the Pipeline.
+    """
+    x_data, y_data = mnist.load(file,
+                                flatten=True,
+                                verbose=verbose,
+                                mmap=True,
+                                raw=True)
+    kwargs.setdefault('scale', 1.0 / 256.0)
+    return Pipeline(x_data, y_data, **kwargs)
+
+
+def cifar10_pipeline(file=None, verbose=True, **kwargs):
+    """
+    Creates a pipeline over the memory mapped CIFAR10 data set. Images are
+    in (32, 32, 3) shape unless flatten is passed.
+
+    :param file: Specifies the training batch, or some other data batch. By
+                 default all of the training batches are used.
+    :param verbose: Toggles verbose printing.
+    :returns: Pipeline over the data set, the other keyword arguments are
+              passed on to the Pipeline.
+    """
+    if file is None:
+        x_data, y_data, _, _ = cifar10.load_all(verbose=verbose,
+                                                mmap=True,
+                                                raw=True)
+    else:
+        x_data, y_data = cifar10.load(file,
+                                      verbose=verbose,
+                                      mmap=True,
+                                      raw=True)
+    return Pipeline(x_data, y_data, **kwargs)
@@ -0,0 +1,164 @@
+"""
+This module is used to hold sparse batches in compressed sparse row (CSR)
+form, for high dimensional inputs like bag of words features.
+"""
+import numpy as np
+
+
+class CSR(object):
+    """
+    Compressed sparse row matrix of shape (samples, features). The values of
+    row i are data[indptr[i]:indptr[i + 1]], in the columns
+    indices[indptr[i]:indptr[i + 1]]. It only supports what the network
+    needs: slicing and gathering rows, converting the type, and converting
+    to a dense array.
+
+    Any object with the same data, indices, indptr and shape attributes, like
+    a scipy.sparse.csr_matrix, can be wrapped without copying by asarray.
+    """
+    ndim = 2
+
+    def __init__(self, data, indices, indptr, shape):
+        """
+        :param data: Nonzero values.
+        :param indices: Column of every value.
+        :param indptr: Start of every row in data and indices, and the end of
+                       the last row.
+        :param shape: Tuple of the number of rows and columns.
+        """
+        self.data = np.asarray(data)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.shape = (int(shape[0]), int(shape[1]))
+
+    @classmethod
+    def from_dense(cls, X, dtype=None):
+        """
+        :param X: Dense (samples, features) array.
+        :param dtype: Type of the values, the type of X by default.
+        :returns: CSR matrix of the nonzero values of X.
+        """
+        X = np.asarray(X, dtype=dtype)
+        rows, columns = np.nonzero(X)
+        indptr = np.zeros(X.shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=X.shape[0]), out=indptr[1:])
+        return cls(X[rows, columns], columns, indptr, X.shape)
+
+    def __repr__(self):
+        return "<CSR {}x{},{} nonzero,{}>".format(self.shape[0],
+                                                  self.shape[1], self.nnz,
+                                                  self.dtype)
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def nnz(self):
+        return int(self.indptr[-1] - self.indptr[0])
+
+    def __getitem__(self, rows):
+        """
+        Selects rows, by a slice without copying the values, or by an array
+        of row numbers, gathering them in order.
+        """
+        if isinstance(rows, slice):
+            start, stop, step = rows.indices(self.shape[0])
+            if step == 1:
+                stop = max(start, stop)
+                first, last = self.indptr[start], self.indptr[stop]
+                return CSR(self.data[first:last], self.indices[first:last],
+                           self.indptr[start:stop + 1] - first,
+                           (stop - start, self.shape[1]))
+            rows = np.arange(start, stop, step)
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+        starts = self.indptr[rows]
+        counts = self.indptr[rows + 1] - starts
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        # Position of every gathered value in data and indices
+        take = np.repeat(starts - indptr[:-1], counts) + np.arange(indptr[-1])
+        return CSR(self.data[take], self.indices[take], indptr,
+                   (len(rows), self.shape[1]))
+
+    def astype(self, dtype, copy=True):
+        """
+        :returns: CSR matrix with the values converted to dtype, sharing the
+                  structure.
+        """
+        return CSR(self.data.astype(dtype, copy=copy), self.indices,
+                   self.indptr, self.shape)
+
+    def toarray(self):
+        """
+        :returns: Dense (samples, features) array.
+        """
+        X = np.zeros(self.shape, dtype=self.dtype)
+        rows = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+        np.add.at(X, (rows, self.indices[self.indptr[0]:self.indptr[-1]]),
+                  self.data[self.indptr[0]:self.indptr[-1]])
+        return X
+
+
+def issparse(X):
+    """
+    :returns: Whether X is a CSR matrix, or has the attributes of one.
+    """
+    return isinstance(X, CSR) or (hasattr(X, "indptr")
+                                  and hasattr(X, "indices"))
+
+
+def asarray(X, dtype=None):
+    """
+    Converts X like np.asarray, except that sparse matrices are kept sparse
+    as a CSR, which is a no-op when it already is one of that type.
+
+    :param X: Array like or sparse matrix.
+    :param dtype: Type of the values, kept by default.
+    :returns: Array or CSR matrix.
+    """
+    if not issparse(X):
+        return np.asarray(X, dtype=dtype)
+    if not isinstance(X, CSR):
+        X = CSR(X.data, X.indices, X.indptr, X.shape)
+    if dtype is not None and X.dtype != dtype:
+        X = X.astype(dtype)
+    return X
+
+
+def compact(X, dtype=None):
+    """
+    Compacts a sparse batch to the columns that have a nonzero value in any
+    of its rows, so a product with a weight matrix only has to touch those
+    columns of the weights.
+
+    :param X: CSR matrix of shape (samples, features).
+    :param dtype: Type of the values, kept by default.
+    :returns: Tuple of the sorted column numbers, and the dense (samples,
+              columns) array of the values in those columns.
+    """
+    first, last = X.indptr[0], X.indptr[-1]
+    columns, inverse = np.unique(np.asarray(X.indices[first:last]),
+                                 return_inverse=True)
+    values = np.zeros((X.shape[0], len(columns)),
+                      dtype=dtype if dtype is not None else X.dtype)
+    rows = np.repeat(np.arange(X.shape[0]), np.diff(X.indptr))
+    np.add.at(values, (rows, inverse.ravel()), X.data[first:last])
+    return columns, values
+
+
+def add_columns(target, columns, values):
+    """
+    Adds values to the given columns of target in place, one row at a time,
+    which is much faster than fancy indexing the columns of the whole
+    matrix at once.
+
+    :param target: 2D array to update.
+    :param columns: Column numbers, without repeats.
+    :param values: Array of shape (rows, columns) to add.
+    """
+    for row, update in zip(target, values):
+        row[columns] = row.take(columns) + update
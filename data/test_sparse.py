@@ -0,0 +1,84 @@
+"""
+Regression tests of the sparse batches, run with python -m pytest or
+python -m unittest
+"""
+import unittest
+
+import numpy as np
+
+import loss
+import optimizer
+from data.sparse import CSR
+from network import Network
+
+
+def sparse_network():
+    """
+    :returns: Network with a wide input, like bag of words features.
+    """
+    np.random.seed(1)
+    nn = Network(loss_function=loss.softmax.Softmax())
+    nn.add_layer(Network.INPUT, shape=500)
+    nn.add_layer(Network.DENSE,
+                 neurons=24,
+                 activation=Network.RELU,
+                 bias_init=0.1)
+    nn.add_layer(Network.DENSE, neurons=4)
+    return nn
+
+
+class SparseTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.dense = (rng.random_sample((200, 500)) < 0.02) * rng.normal(
+            size=(200, 500))
+        self.sparse = CSR.from_dense(self.dense)
+        self.Y = rng.randint(0, 4, size=200)
+
+    def test_rows(self):
+        order = np.random.RandomState(1).permutation(200)[:50]
+        np.testing.assert_array_equal(self.sparse.toarray(), self.dense)
+        np.testing.assert_array_equal(self.sparse[10:60].toarray(),
+                                      self.dense[10:60])
+        np.testing.assert_array_equal(self.sparse[order].toarray(),
+                                      self.dense[order])
+
+    def test_training_matches_dense(self):
+        optimizers = [
+            lambda: None, lambda: optimizer.sgd.SGD(0.1, 0.9),
+            lambda: optimizer.adam.Adam(0.01)
+        ]
+        for make in optimizers:
+            for compiled in [False, True]:
+                dense = sparse_network()
+                sparse = sparse_network()
+                if compiled:
+                    dense.compile(32)
+                    sparse.compile(32)
+                np.random.seed(2)
+                expected = dense.fit(self.dense,
+                                     self.Y,
+                                     epochs=2,
+                                     batch_size=32,
+                                     optimizer=make())
+                np.random.seed(2)
+                history = sparse.fit(self.sparse,
+                                     self.Y,
+                                     epochs=2,
+                                     batch_size=32,
+                                     optimizer=make())
+                np.testing.assert_allclose(history, expected, rtol=1e-10)
+                for lay, ref in zip(sparse.layers[1:], dense.layers[1:]):
+                    np.testing.assert_allclose(lay.weights,
+                                               ref.weights,
+                                               rtol=1e-10,
+                                               atol=1e-12)
+                np.testing.assert_allclose(sparse.predict(self.sparse),
+                                           dense.predict(self.dense),
+                                           rtol=1e-10,
+                                           atol=1e-12)
+
+
+if __name__ == "__main__":
+    unittest.main()
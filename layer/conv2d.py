@@ -0,0 +1,331 @@
+"""Defines a 2D convolution layer class"""
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+import buffers
+from layer.input import Input
+
+
+def pair(value):
+    """
+    :returns: Tuple of two ints, from an int or a pair.
+    """
+    if np.ndim(value) == 0:
+        return (int(value), int(value))
+    return tuple(int(v) for v in value)
+
+
+def windows(X, size, stride):
+    """
+    Read-only strided view of every window of a (batch, height, width,
+    channels) array, without copying anything.
+
+    :param X: Array in NHWC layout.
+    :param size: Tuple of the window height and width.
+    :param stride: Tuple of the vertical and horizontal step between windows.
+    :returns: View of shape (batch, rows, columns, height, width, channels),
+              with the window at every output position.
+    """
+    batch, height, width, channels = X.shape
+    rows = (height - size[0]) // stride[0] + 1
+    columns = (width - size[1]) // stride[1] + 1
+    sb, sh, sw, sc = X.strides
+    return as_strided(X,
+                      shape=(batch, rows, columns, size[0], size[1],
+                             channels),
+                      strides=(sb, sh * stride[0], sw * stride[1], sh, sw, sc),
+                      writeable=False)
+
+
+class Conv2D(object):
+    """
+    Convolution layer class. Inputs are batches of images in (batch, height,
+    width, channels) layout, and the outputs are (batch, rows, columns,
+    filters).
+
+    The windows of the batch are gathered from a strided view into a single
+    (batch * rows * columns, kernel * channels) matrix, so the whole batch is
+    one matrix-matrix product with the (filters, kernel * channels) weights,
+    the same layout as the weights of Dense. The backward propagation is the
+    transposed product, scattered back with one strided add per kernel
+    offset.
+    """
+
+    def __init__(self,
+                 source_layer,
+                 filters,
+                 kernel_size=3,
+                 stride=1,
+                 padding=0,
+                 activation=None,
+                 weight_init=None,
+                 bias_init=None,
+                 name=None,
+                 dtype=np.float64,
+                 accumulate_dtype=None):
+        """
+        :param source_layer: Layer with a (height, width, channels) shape.
+        :param filters: Number of output channels.
+        :param kernel_size: Window height and width, or a single size.
+        :param stride: Step between windows, or a single step.
+        :param padding: Zeros added on every side, or "same" to keep the
+                        height and width with a stride of 1.
+        """
+        if np.ndim(getattr(source_layer, "shape", None)) != 1 or len(
+                source_layer.shape) != 3:
+            raise ValueError(
+                "Conv2D needs a (height, width, channels) source layer")
+        self.source_layer = source_layer
+        self.filters = filters
+        self.kernel_size = pair(kernel_size)
+        self.stride = pair(stride)
+        if padding == "same":
+            padding = (self.kernel_size[0] // 2, self.kernel_size[1] // 2)
+        self.padding = pair(padding)
+        height, width, channels = source_layer.shape
+        self.input_shape = (height, width, channels)
+        self.shape = ((height + 2 * self.padding[0] - self.kernel_size[0]) //
+                      self.stride[0] + 1,
+                      (width + 2 * self.padding[1] - self.kernel_size[1]) //
+                      self.stride[1] + 1, filters)
+        self.output_size = int(np.prod(self.shape))
+        self.activation = activation() if activation is not None else None
+        self.name = name
+        self.input = None
+        self.saved = None
+        self.dtype = np.dtype(dtype)
+        self.accumulate_dtype = np.dtype(
+            accumulate_dtype if accumulate_dtype is not None else dtype)
+        fan_in = self.kernel_size[0] * self.kernel_size[1] * channels
+        if weight_init is None:
+            self.weights = np.random.randn(filters, fan_in) * np.sqrt(
+                2.0 / fan_in)
+        elif isinstance(weight_init, np.ndarray):
+            self.weights = weight_init
+        else:
+            self.weights = np.fromfunction(weight_init, (filters, fan_in))
+        self.weights = self.weights.astype(self.dtype, copy=False)
+        if bias_init is None:
+            self.bias = np.random.randn()
+        elif isinstance(bias_init, (float, np.ndarray)):
+            self.bias = bias_init
+        else:
+            self.bias = bias_init()
+        if np.shape(self.bias) == (filters, ):
+            self.bias = np.asarray(self.bias).astype(self.dtype, copy=False)
+        else:
+            self.bias = np.full(filters, self.bias, dtype=self.dtype)
+        self.grad_weights = np.zeros(self.weights.shape,
+                                     dtype=self.accumulate_dtype)
+        self.grad_bias = np.zeros(self.bias.shape, dtype=self.accumulate_dtype)
+        self.workspace = {}
+
+    def __repr__(self):
+        return "<Layer.Conv2D({}) {},{},{}x{},{}>".format(
+            self.name, self.source_layer.name, self.filters,
+            self.kernel_size[0], self.kernel_size[1], self.activation)
+
+    def repr(self):
+        return "<Layer.Conv2D {},{}x{} {}>".format(self.filters,
+                                                   self.kernel_size[0],
+                                                   self.kernel_size[1],
+                                                   self.source_layer.repr())
+
+    def config(self):
+        """
+        :returns: Dict of the arguments that rebuild the layer, for
+                  Network.save.
+        """
+        return {
+            "filters": self.filters,
+            "kernel_size": self.kernel_size,
+            "stride": self.stride,
+            "padding": self.padding
+        }
+
+    def buffer(self, name, shape, dtype, workspace=None):
+        """
+        :returns: The buffers.get array of the given workspace dict, or of
+                  the workspace of the layer.
+        """
+        return buffers.get(self.workspace if workspace is None else workspace,
+                           name, shape, dtype)
+
+    def columns(self, X, name, workspace=None):
+        """
+        Gathers the windows of the batch X into the im2col matrix, padding
+        it first if needed. The buffers are named after name, so the
+        training and the inference buffers are separate.
+
+        :returns: The (batch * rows * columns, kernel * channels) matrix,
+                  which is a workspace buffer.
+        """
+        batch = len(X)
+        ph, pw = self.padding
+        if ph or pw:
+            height, width, channels = self.input_shape
+            padded = self.buffer(
+                name + ' padded',
+                (batch, height + 2 * ph, width + 2 * pw, channels), X.dtype,
+                workspace)
+            padded.fill(0)
+            padded[:, ph:ph + height, pw:pw + width] = X
+            X = padded
+        view = windows(X, self.kernel_size, self.stride)
+        cols = self.buffer(name + ' columns', view.shape, X.dtype,
+                           workspace)
+        np.copyto(cols, view)
+        return cols.reshape(batch * self.shape[0] * self.shape[1], -1)
+
+    def convolve(self, X, name, workspace=None):
+        """
+        Computes the convolution of X and the bias with a single product.
+
+        :returns: Tuple of the im2col matrix and the (batch, rows, columns,
+                  filters) output, which are workspace buffers.
+        """
+        X = np.asarray(X).reshape((len(X), ) + self.input_shape)
+        cols = self.columns(X, name, workspace)
+        out = self.buffer(name, (len(X), ) + self.shape,
+                          np.result_type(cols, self.weights), workspace)
+        flat = out.reshape(len(cols), self.filters)
+        np.matmul(cols, self.weights.T, out=flat)
+        np.add(flat, self.bias, out=flat)
+        return cols, out
+
+    def forward_prop(self):
+        """
+        Computes the output for the whole batch at once. The returned array
+        is a workspace buffer, which is overwritten by the next forward pass
+        with the same batch size.
+        """
+        self.input, out = self.convolve(self.source_layer.forward_prop(),
+                                        'output')
+        if self.activation:
+            self.saved = self.activation.activate(out)
+        return out
+
+    def infer(self, X, context=None):
+        """
+        Inference mode forward propagation of X, which doesn't recurse into
+        the source layer or keep anything for backward propagation. If a
+        context dict is given, the buffers are kept in it instead of the
+        layer.
+        """
+        workspace = None
+        if context is not None:
+            workspace = context.setdefault(id(self), {})
+        _, out = self.convolve(X, 'infer', workspace)
+        if self.activation:
+            if context is not None:
+                workspace = context.setdefault(id(self.activation), {})
+            self.activation.infer(out, out=out, workspace=workspace)
+        return out
+
+    def backward_prop(self, dD):
+        """
+        Accumulates the gradients summed over the batch, and passes the
+        gradient of the input images back to the source layer, unless that
+        is the input layer. The activation overwrites dD in place.
+        """
+        if self.activation:
+            dD = self.activation.chain(self.saved, dD)
+        flat = dD.reshape(len(self.input), self.filters)
+        self.grad_bias += flat.sum(axis=0,
+                                   dtype=self.accumulate_dtype,
+                                   out=self.buffer('grad_bias',
+                                                   self.bias.shape,
+                                                   self.accumulate_dtype))
+        self.grad_weights += np.matmul(
+            flat.T,
+            self.input,
+            out=self.buffer('grad_weights', self.weights.shape,
+                            np.result_type(flat, self.input)))
+        if isinstance(self.source_layer, Input):
+            return
+        grad_cols = np.matmul(flat,
+                              self.weights,
+                              out=self.buffer('grad_columns', self.input.shape,
+                                              np.result_type(
+                                                  flat, self.weights)))
+        self.source_layer.backward_prop(self.scatter(grad_cols, len(dD)))
+
+    def scatter(self, grad_cols, batch):
+        """
+        Adds the gradient of every window back onto the pixels it was
+        gathered from (col2im), one strided slice per kernel offset.
+
+        :returns: The (batch, height, width, channels) gradient of the input,
+                  which is a workspace buffer.
+        """
+        height, width, channels = self.input_shape
+        ph, pw = self.padding
+        rows, columns, _ = self.shape
+        kh, kw = self.kernel_size
+        sh, sw = self.stride
+        grad = self.buffer('grad_input', (batch, height + 2 * ph,
+                                          width + 2 * pw, channels),
+                           grad_cols.dtype)
+        grad.fill(0)
+        grad_cols = grad_cols.reshape(batch, rows, columns, kh, kw, channels)
+        for i in range(kh):
+            for j in range(kw):
+                grad[:, i:i + sh * rows:sh,
+                     j:j + sw * columns:sw] += grad_cols[:, :, :, i, j]
+        return grad[:, ph:ph + height, pw:pw + width]
+
+    def update_weights(self, count, optimizer=None):
+        """
+        Applies the gradients accumulated over count samples, then continues
+        with the source layer.
+        """
+        self.apply_gradients(count, optimizer)
+        if self.activation:
+            self.activation.update_weights(count)
+        self.source_layer.update_weights(count, optimizer)
+
+    def apply_gradients(self, count, optimizer=None):
+        """
+        Applies the gradients accumulated over count samples of this layer
+        only, either as a plain step or through the given optimizer, then
+        clears them in place.
+        """
+        if optimizer is None:
+            self.grad_weights /= count
+            self.grad_bias /= count
+            self.weights -= self.grad_weights
+            self.bias -= self.grad_bias
+        else:
+            optimizer.update(self.weights, self.grad_weights, count,
+                             (self, "weights"))
+            optimizer.update(self.bias, self.grad_bias, count, (self, "bias"))
+        self.grad_weights.fill(0.0)
+        self.grad_bias.fill(0.0)
+
+    def cost(self, phase, batch, grad_input=True):
+        """
+        Estimates the floating point operations and the bytes moved by one
+        call, from the shapes alone, like Dense.cost with one row per output
+        position.
+
+        :returns: Tuple of (flops, bytes).
+        """
+        positions = batch * self.shape[0] * self.shape[1]
+        filters, fan_in = self.weights.shape
+        params = self.weights.size + self.bias.size
+        itemsize = self.dtype.itemsize
+        if phase in ("forward", "infer"):
+            flops = 2 * positions * fan_in * filters + positions * filters
+            items = positions * fan_in + params + positions * filters
+        elif phase == "backward":
+            flops = 2 * positions * fan_in * filters + positions * filters
+            items = positions * filters + positions * fan_in + params
+            if grad_input and not isinstance(self.source_layer, Input):
+                flops += 2 * positions * fan_in * filters
+                items += self.weights.size + positions * fan_in
+        elif phase == "update":
+            flops = 2 * params
+            items = 3 * params
+        else:
+            return 0, 0
+        return flops, items * itemsize
@@ -1,9 +1,26 @@
 """Defines a dense layer class"""
 import numpy as np
 
+import buffers
+from data.sparse import add_columns, compact, issparse
+
 
 class Dense(object):
-    """Dense layer class"""
+    """
+    Dense layer class. Inputs are batches of shape (batch, features), and the
+    outputs are (batch, neurons), so a whole batch is a single matrix-matrix
+    product.
+
+    The weights and bias are stored as dtype, which is also the compute type
+    of the forward and backward passes. If accumulate_dtype is given, the
+    gradient sums are kept in that type instead, e.g. float64 sums for a
+    float32 layer.
+
+    Image batches, e.g. from Conv2D, are flattened to (batch, features).
+    Sparse CSR batches from the input layer are compacted to the columns
+    with a nonzero value, so the product, the weight gradient and the plain
+    update only touch those columns of the weights.
+    """
 
     def __init__(self,
                  source_layer,
@@ -11,27 +28,46 @@ class Dense(object):
                  activation=None,
                  weight_init=None,
                  bias_init=None,
-                 name=None):
+                 name=None,
+                 dtype=np.float64,
+                 accumulate_dtype=None):
         self.source_layer = source_layer
         self.output_size = neurons
         self.activation = activation() if activation is not None else None
         self.name = name
         self.input = None
+        self.saved = None
+        self.dtype = np.dtype(dtype)
+        self.accumulate_dtype = np.dtype(
+            accumulate_dtype if accumulate_dtype is not None else dtype)
         if weight_init is None:
             self.weights = np.random.randn(
-                self.output_size, self.source_layer.output_size) * np.sqrt(
+                self.output_size, int(np.prod(
+                    self.source_layer.output_size))) * np.sqrt(
                     2.0 / self.output_size)
         elif isinstance(weight_init, np.ndarray):
             self.weights = weight_init
         else:
             self.weights = np.fromfunction(weight_init, (self.output_size))
+        self.weights = self.weights.astype(self.dtype, copy=False)
         if bias_init is None:
             self.bias = np.random.randn()
-        elif isinstance(bias_init, float):
+        elif isinstance(bias_init, (float, np.ndarray)):
             self.bias = bias_init
         else:
             self.bias = bias_init()
-        self.grad_weights = np.zeros(self.weights.shape)
+        if np.shape(self.bias) == (self.output_size, ):
+            self.bias = np.asarray(self.bias).astype(self.dtype, copy=False)
+        else:
+            self.bias = np.full(self.output_size, self.bias, dtype=self.dtype)
+        self.grad_weights = np.zeros(self.weights.shape,
+                                     dtype=self.accumulate_dtype)
+        self.grad_bias = np.zeros(self.bias.shape, dtype=self.accumulate_dtype)
+        self.columns = None
+        self.source_shape = None
+        self.pending = []
+        self.dense_gradients = False
+        self.workspace = {}
 
     def __repr__(self):
         return "<Layer.Dense({}) {},{},{}>".format(
@@ -43,22 +79,193 @@ class Dense(object):
                                                self.activation,
                                                self.source_layer.repr())
 
+    def buffer(self, name, shape, dtype, workspace=None):
+        """
+        :returns: The buffers.get array of the given workspace dict, or of
+                  the workspace of the layer.
+        """
+        return buffers.get(self.workspace if workspace is None else workspace,
+                           name, shape, dtype)
+
     def forward_prop(self):
+        """
+        Computes the output for the whole (batch, features) input at once.
+        The bias and the activation are applied in place on the result of the
+        matrix product, and the activation only keeps what its backward
+        propagation needs. The returned array is a workspace buffer, which is
+        overwritten by the next forward pass with the same batch size.
+        """
         self.input = self.source_layer.forward_prop()
+        weights = self.weights
+        self.columns = None
+        self.source_shape = None
+        if issparse(self.input):
+            self.columns, self.input = compact(self.input, self.dtype)
+            weights = weights.take(self.columns, axis=1)
+        elif self.input.ndim > 2:
+            self.source_shape = self.input.shape
+            self.input = self.input.reshape(len(self.input), -1)
+        dtype = np.result_type(self.input, weights)
+        out = self.buffer('output', self.input.shape[:-1] +
+                          (self.output_size, ), dtype)
+        np.matmul(self.input, weights.T, out=out)
+        np.add(out, self.bias, out=out)
         if self.activation:
-            return self.activation(self.weights @ self.input) + self.bias
-        return (self.weights @ self.input) + self.bias
+            self.saved = self.activation.activate(out)
+        return out
+
+    def infer(self, X, context=None):
+        """
+        Inference mode forward propagation of X, which doesn't recurse into
+        the source layer or keep anything for backward propagation. The
+        returned array is a workspace buffer.
+
+        If a context dict is given, the buffers are kept in it instead of the
+        layer, and the layer is only read, so concurrent calls with their own
+        contexts are safe.
+        """
+        workspace = None
+        if context is not None:
+            workspace = context.setdefault(id(self), {})
+        weights = self.weights
+        if issparse(X):
+            columns, X = compact(X, self.dtype)
+            weights = weights.take(columns, axis=1)
+        elif np.ndim(X) > 2:
+            X = np.reshape(X, (len(X), -1))
+        out = self.buffer('infer', X.shape[:-1] + (self.output_size, ),
+                          np.result_type(X, weights), workspace)
+        np.matmul(X, weights.T, out=out)
+        np.add(out, self.bias, out=out)
+        if self.activation:
+            if context is not None:
+                workspace = context.setdefault(id(self.activation), {})
+            self.activation.infer(out, out=out, workspace=workspace)
+        return out
 
     def backward_prop(self, dD):
-        # TODO Verify that this is the proper backprop for a dense layer. I
-        #      don't think it is.
+        """
+        Accumulates the gradients summed over the batch, and passes the
+        (batch, features) gradient back to the source layer. The activation
+        overwrites dD in place. For a sparse batch the weight gradient is only
+        computed for the columns it touched, and as only the input layer gives
+        sparse batches, no gradient is passed back.
+        """
         if self.activation:
-            dD = self.activation.backward_prop(dD)
-        self.grad_weights += dD[None].T @ self.input[None]
-        self.source_layer.backward_prop(self.weights.T @ dD)
-
-    def update_weights(self, count):
-        self.weights -= (self.grad_weights / count)
-        self.grad_weights = np.zeros(self.weights.shape)
-        self.activation.update_weights(count)
-        self.source_layer.update_weights(count)
+            dD = self.activation.chain(self.saved, dD)
+        self.grad_bias += dD.sum(axis=0,
+                                 dtype=self.accumulate_dtype,
+                                 out=self.buffer('grad_bias', self.bias.shape,
+                                                 self.accumulate_dtype))
+        if self.columns is not None:
+            self.accumulate_columns(self.columns, dD, self.input)
+            return
+        self.dense_gradients = True
+        self.grad_weights += np.matmul(
+            dD.T,
+            self.input,
+            out=self.buffer('grad_weights', self.weights.shape,
+                            np.result_type(dD, self.input)))
+        grad = np.matmul(dD,
+                         self.weights,
+                         out=self.buffer('grad_input', self.input.shape,
+                                         np.result_type(dD, self.weights)))
+        if self.source_shape is not None:
+            grad = grad.reshape(self.source_shape)
+        self.source_layer.backward_prop(grad)
+
+    def accumulate_columns(self, columns, dD, values):
+        """
+        Keeps the weight gradient of a sparse batch for the given columns
+        only, until apply_gradients.
+
+        :param columns: Sorted column numbers from data.sparse.compact.
+        :param dD: Gradient of the (batch, neurons) output.
+        :param values: Compacted (batch, columns) input.
+        """
+        self.pending.append((columns,
+                             np.matmul(dD.T, values,
+                                       dtype=self.accumulate_dtype)))
+
+    def update_weights(self, count, optimizer=None):
+        """
+        Applies the gradients accumulated over count samples, then continues
+        with the source layer.
+        """
+        self.apply_gradients(count, optimizer)
+        if self.activation:
+            self.activation.update_weights(count)
+        self.source_layer.update_weights(count, optimizer)
+
+    def apply_gradients(self, count, optimizer=None):
+        """
+        Applies the gradients accumulated over count samples of this layer
+        only, either as a plain step or through the given optimizer, then
+        clears them in place.
+
+        The gradients of sparse batches are kept per column. If there were
+        only sparse batches since the last update, the plain step only
+        updates the columns they touched. The optimizers keep state for every
+        parameter, so they always update the whole layer.
+        """
+        pending, self.pending = self.pending, []
+        dense_gradients, self.dense_gradients = self.dense_gradients, False
+        if optimizer is None and pending:
+            for columns, grad in pending:
+                grad *= -1.0 / count
+                add_columns(self.weights, columns, grad)
+            if not dense_gradients:
+                self.grad_bias /= count
+                self.bias -= self.grad_bias
+                self.grad_bias.fill(0.0)
+                return
+        else:
+            for columns, grad in pending:
+                add_columns(self.grad_weights, columns, grad)
+        if optimizer is None:
+            self.grad_weights /= count
+            self.grad_bias /= count
+            self.weights -= self.grad_weights
+            self.bias -= self.grad_bias
+        else:
+            optimizer.update(self.weights, self.grad_weights, count,
+                             (self, "weights"))
+            optimizer.update(self.bias, self.grad_bias, count, (self, "bias"))
+        self.grad_weights.fill(0.0)
+        self.grad_bias.fill(0.0)
+
+    def cost(self, phase, batch, grad_input=True):
+        """
+        Estimates the floating point operations and the bytes moved by one
+        call, from the shapes alone. Every operand is counted as read or
+        written once, and the activation is left out. After a sparse batch
+        only its nonzero columns are counted.
+
+        :param phase: "forward", "infer", "backward" or "update".
+        :param batch: Number of samples in the batch.
+        :param grad_input: Whether backward propagation computes the gradient
+                           of the input, which the first layer can skip.
+        :returns: Tuple of (flops, bytes).
+        """
+        outputs, inputs = self.weights.shape
+        if self.columns is not None and phase in ("forward", "backward"):
+            inputs = len(self.columns)
+            grad_input = False
+        params = self.weights.size + self.bias.size
+        itemsize = self.dtype.itemsize
+        if phase in ("forward", "infer"):
+            flops = 2 * batch * inputs * outputs + batch * outputs
+            items = batch * inputs + params + batch * outputs
+        elif phase == "backward":
+            flops = 2 * batch * inputs * outputs + batch * outputs
+            items = batch * outputs + batch * inputs + params
+            if grad_input:
+                flops += 2 * batch * inputs * outputs
+                items += self.weights.size + batch * inputs
+            itemsize = max(itemsize, self.accumulate_dtype.itemsize)
+        elif phase == "update":
+            flops = 2 * params
+            items = 3 * params
+        else:
+            return 0, 0
+        return flops, items * itemsize
@@ -1,12 +1,21 @@
 """Defines an input layer class"""
+import numpy as np
+
+from data import sparse
+
 
 class Input(object):
-    """Input layer class"""
+    """
+    Input layer class. If a dtype is given, loaded data is converted to it,
+    which is a no-op when the data already has that type. Sparse batches,
+    see data.sparse, are kept as CSR matrices.
+    """
 
-    def __init__(self, shape=None, name=None):
+    def __init__(self, shape=None, name=None, dtype=None):
         self.shape = shape
         self.name = name
         self.output_size = shape
+        self.dtype = np.dtype(dtype) if dtype is not None else None
 
     def __repr__(self):
         return "<Layer.input({}) {}>".format(self.name, self.shape)
@@ -15,10 +24,16 @@ class Input(object):
         return "<Layer.input {} {}>".format(self.name, self.shape)
 
     def load_data(self, data):
-        self.data = data
+        self.data = sparse.asarray(data, dtype=self.dtype)
 
     def set_data(self, data):
-        self.data = data
+        self.load_data(data)
+
+    def infer(self, X, context=None):
+        """
+        Inference mode pass through, converting X without storing it.
+        """
+        return sparse.asarray(X, dtype=self.dtype)
 
     def forward_prop(self):
         return self.data
@@ -26,5 +41,5 @@ class Input(object):
     def backward_prop(self, dD):
         pass
 
-    def update_weights(self, count):
+    def update_weights(self, count, optimizer=None):
         pass
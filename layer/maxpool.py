@@ -0,0 +1,152 @@
+"""Defines a 2D max pooling layer class"""
+import numpy as np
+
+import buffers
+from layer.conv2d import pair, windows
+from layer.input import Input
+
+
+class MaxPool(object):
+    """
+    Max pooling layer class. Inputs are batches of images in (batch, height,
+    width, channels) layout, and every channel is reduced to the maximum of
+    each window. The windows are a strided view of the input, so nothing is
+    copied, and only the position of the maximum in every window is kept for
+    the backward propagation, which scatters the gradient back with one
+    strided add per window offset.
+    """
+
+    def __init__(self,
+                 source_layer,
+                 pool_size=2,
+                 stride=None,
+                 name=None,
+                 dtype=None,
+                 accumulate_dtype=None):
+        """
+        :param source_layer: Layer with a (height, width, channels) shape.
+        :param pool_size: Window height and width, or a single size.
+        :param stride: Step between windows, the pool size by default.
+        """
+        if np.ndim(getattr(source_layer, "shape", None)) != 1 or len(
+                source_layer.shape) != 3:
+            raise ValueError(
+                "MaxPool needs a (height, width, channels) source layer")
+        self.source_layer = source_layer
+        self.pool_size = pair(pool_size)
+        self.stride = pair(stride if stride is not None else pool_size)
+        height, width, channels = source_layer.shape
+        self.input_shape = (height, width, channels)
+        self.shape = ((height - self.pool_size[0]) // self.stride[0] + 1,
+                      (width - self.pool_size[1]) // self.stride[1] + 1,
+                      channels)
+        self.output_size = int(np.prod(self.shape))
+        self.name = name
+        self.dtype = np.dtype(dtype) if dtype is not None else None
+        self.saved = None
+        self.workspace = {}
+
+    def __repr__(self):
+        return "<Layer.MaxPool({}) {},{}x{}>".format(self.name,
+                                                     self.source_layer.name,
+                                                     self.pool_size[0],
+                                                     self.pool_size[1])
+
+    def repr(self):
+        return "<Layer.MaxPool {}x{} {}>".format(self.pool_size[0],
+                                                 self.pool_size[1],
+                                                 self.source_layer.repr())
+
+    def config(self):
+        """
+        :returns: Dict of the arguments that rebuild the layer, for
+                  Network.save.
+        """
+        return {"pool_size": self.pool_size, "stride": self.stride}
+
+    def buffer(self, name, shape, dtype, workspace=None):
+        """
+        :returns: The buffers.get array of the given workspace dict, or of
+                  the workspace of the layer.
+        """
+        return buffers.get(self.workspace if workspace is None else workspace,
+                           name, shape, dtype)
+
+    def pool(self, X, name, workspace=None):
+        """
+        :returns: The (batch, rows, columns, channels) maxima of the windows
+                  of X, which is a workspace buffer.
+        """
+        X = np.asarray(X).reshape((len(X), ) + self.input_shape)
+        view = windows(X, self.pool_size, self.stride)
+        return np.max(view,
+                      axis=(3, 4),
+                      out=self.buffer(name, (len(X), ) + self.shape, X.dtype,
+                                      workspace))
+
+    def forward_prop(self):
+        """
+        Computes the maxima for the whole batch at once, one window offset at
+        a time, keeping the offset of the maximum in every window as a small
+        integer array for the backward propagation.
+        """
+        X = self.source_layer.forward_prop()
+        X = np.asarray(X).reshape((len(X), ) + self.input_shape)
+        view = windows(X, self.pool_size, self.stride)
+        shape = (len(X), ) + self.shape
+        out = self.buffer('output', shape, X.dtype)
+        offsets = self.buffer(
+            'offsets', shape,
+            np.uint8 if self.pool_size[0] * self.pool_size[1] <= 256 else
+            np.intp)
+        mask = self.buffer('mask', shape, bool)
+        np.copyto(out, view[:, :, :, 0, 0])
+        offsets.fill(0)
+        for i in range(self.pool_size[0]):
+            for j in range(self.pool_size[1]):
+                if i or j:
+                    window = view[:, :, :, i, j]
+                    np.greater(window, out, out=mask)
+                    np.copyto(out, window, where=mask)
+                    np.copyto(offsets, i * self.pool_size[1] + j, where=mask)
+        self.saved = offsets
+        return out
+
+    def infer(self, X, context=None):
+        """
+        Inference mode forward propagation of X, which doesn't recurse into
+        the source layer or keep anything for backward propagation.
+        """
+        workspace = None
+        if context is not None:
+            workspace = context.setdefault(id(self), {})
+        return self.pool(X, 'infer', workspace)
+
+    def backward_prop(self, dD):
+        """
+        Routes the gradient of every window to the position of its maximum,
+        and passes it back to the source layer, unless that is the input
+        layer.
+        """
+        if isinstance(self.source_layer, Input):
+            return
+        rows, columns, _ = self.shape
+        sh, sw = self.stride
+        grad = self.buffer('grad_input', (len(dD), ) + self.input_shape,
+                           dD.dtype)
+        grad.fill(0)
+        mask = self.buffer('mask', dD.shape, bool)
+        routed = self.buffer('routed', dD.shape, dD.dtype)
+        for i in range(self.pool_size[0]):
+            for j in range(self.pool_size[1]):
+                np.equal(self.saved, i * self.pool_size[1] + j, out=mask)
+                np.multiply(dD, mask, out=routed)
+                grad[:, i:i + sh * rows:sh, j:j + sw * columns:sw] += routed
+        self.source_layer.backward_prop(grad)
+
+    def update_weights(self, count, optimizer=None):
+        """
+        Pooling has no parameters, so this only continues with the source
+        layer.
+        """
+        self.source_layer.update_weights(count, optimizer)
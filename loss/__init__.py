@@ -1,13 +1,15 @@
-from os.path import dirname, basename, isfile
-import glob
+"""
+The submodules are imported on first access, e.g. loss.softmax, instead of
+globbing and importing the whole directory. The types are looked up by name
+through registry.
+"""
 import importlib
-modules = glob.glob(dirname(__file__) + "/*.py")
-__all__ = [
-    basename(f)[:-3]
-    for f in modules
-    if isfile(f) and not f.endswith('__init__.py')
-]
-for module in __all__:
-    __import__("loss.{}".format(module), locals(), globals())
-    # globals().update(importlib.import_module("layer.{}".format(module)).__dict__)
-del module
+
+__all__ = ["softmax"]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module("loss.{}".format(name))
+    raise AttributeError("module 'loss' has no attribute {!r}".format(
+        name))
@@ -4,19 +4,80 @@ Defines softmax loss function
 
 import numpy as np
 
+import buffers
+
 
 class Softmax(object):
+    """
+    Softmax class to handle the softmax and cross-entropy loss of the scores
+    from the last layer as a single fused operation. Scores are batches of
+    shape (batch, classes), and the labels are either integer class indices
+    or one-hot score arrays.
+    """
 
     def __init__(self):
         self.input = 0.0
+        self.labels = None
+        self.probs = None
+        self.workspace = {}
 
     def __repr__(self):
         return "<Loss.Softmax>"
 
-    def forward_prop(self, X):
-        # I didn't fully know how to setup the loss function
+    def buffer(self, name, shape, dtype, workspace=None):
+        """
+        :returns: The buffers.get array of the given workspace dict, or of
+                  the workspace of the loss.
+        """
+        return buffers.get(self.workspace if workspace is None else workspace,
+                           name, shape, dtype)
+
+    def probabilities(self, X, out=None):
+        """
+        Computes the softmax of the scores, shifting by the largest score of
+        every sample so exp can't overflow.
+
+        :param X: Scores of shape (batch, classes).
+        :param out: Array to write the probabilities to, allocated if None.
+        :returns: The probabilities of the classes.
+        """
+        out = np.subtract(X, X.max(axis=-1, keepdims=True), out=out)
+        np.exp(out, out=out)
+        out /= out.sum(axis=-1, keepdims=True)
+        return out
+
+    def forward_prop(self, X, labels=None):
+        """
+        Computes the mean cross-entropy loss of the batch with the log-sum-exp
+        trick, keeping the probabilities for the backward propagation.
+
+        :param X: Scores of shape (batch, classes).
+        :param labels: Integer class indices of shape (batch, ), or one-hot
+                       scores of shape (batch, classes).
+        :returns: The mean loss of the batch.
+        """
+        X = X.reshape(-1, X.shape[-1])
         self.input = X
+        self.labels = labels
+        probs = self.buffer('probs', X.shape, X.dtype)
+        np.subtract(X, X.max(axis=-1, keepdims=True), out=probs)
+        if labels.ndim == probs.ndim:
+            picked = np.einsum('ij,ij->i', probs, labels)
+        else:
+            picked = probs[np.arange(len(probs)), labels]
+        np.exp(probs, out=probs)
+        total = probs.sum(axis=-1, keepdims=True)
+        probs /= total
+        self.probs = probs
+        return float(np.mean(np.log(total[:, 0]) - picked))
 
     def backward_prop(self):
-        # I definently didn't know how to back propogate the loss function
-        return np.zeros(self.input.shape)
+        """
+        Returns the gradient of the loss of every sample with respect to its
+        scores, probs - onehot, written over the stored probabilities.
+        """
+        if self.labels.ndim == self.probs.ndim:
+            self.probs -= self.labels
+        else:
+            self.probs[np.arange(len(self.probs)), self.labels] -= 1.0
+        return self.probs
@@ -4,15 +4,17 @@ Startup script for ML projects
 """
 
 # import matplotlib.pyplot as plt
-from network import Network
 # import data
 # import layer
 # import activation
 
 def main():
     """
-    Function that is called on startup of the ML project code
+    Function that is called on startup of the ML project code. Network is
+    imported here rather than at the top, so importing this module stays
+    cheap.
     """
+    from network import Network
     nn = Network()
     nn.add_layer(Network.INPUT, shape=10)
     nn.add_layer(Network.DENSE, neurons=500)
@@ -2,10 +2,26 @@
 Defines a network class that handles all of the construction and training of
 the network
 """
+import json
+import os
+import struct
 from enum import Enum
 
+import numpy as np
+
 import layer
-import activation
+import registry
+from data import sparse
+
+# plan and parallel are imported in compile and fit, so that loading a model
+# for inference does not pay for multiprocessing.
+
+# Checkpoint file layout: MAGIC, then the format version and the header size
+# as little endian uint32, then the JSON header describing the architecture.
+# The weight blobs follow, each starting on an ALIGN byte boundary.
+MAGIC = b"MATHAINN"
+VERSION = 2
+ALIGN = 64
 
 
 class Network(object):
@@ -15,16 +31,33 @@ class Network(object):
     SIGMOID = 11
     RELU = 12
 
-    def __init__(self, architecture=[], loss_function=None):
+    # Registry names of the integer constants
+    LAYERS = {INPUT: "input", DENSE: "dense"}
+    ACTIVATIONS = {SIGMOID: "sigmoid", RELU: "relu"}
+
+    def __init__(self,
+                 architecture=[],
+                 loss_function=None,
+                 dtype=np.float64,
+                 accumulate_dtype=None):
         """
         Initializes a neural network structure, with a given architecture and
         loss function. This initialization is where the hyperparameters will
         be set. But for now I'm keeping things simple.
+
+        The dtype is used for the parameters and all of the computation of the
+        layers, so np.float32 halves the memory and bandwidth of the network.
+        The accumulate_dtype can be set to np.float64 to keep the gradient
+        sums in double precision anyway.
         """
         self.architecture = architecture
         self.layers = []
-        self.loss_function = None
-        self.layer_count = {self.INPUT: 0, self.DENSE: 0}
+        self.loss_function = loss_function
+        self.dtype = np.dtype(dtype)
+        self.accumulate_dtype = accumulate_dtype
+        self.layer_count = {}
+        self.plan = None
+        self.profiler = None
         for layer in architecture:
             if isinstance(layer, dict):
                 ltype = layer['type']
@@ -41,60 +74,412 @@ class Network(object):
         note that python makes these links by reference, so changing something
         in the list is the same as changing the value in the layer chain. This
         means that this works nicely.
+
+        The layer type and the activation can be given as one of the integer
+        constants, as a name in registry, or as a class. Every layer is given
+        the dtype of the network, and every layer after the input is given its
+        source layer and the accumulate_dtype.
         """
-        if not self.layers and layer_type != self.INPUT:
+        layer_type = self.LAYERS.get(layer_type, layer_type)
+        if isinstance(layer_type, str):
+            name = layer_type
+            layer_type = registry.layers.get(name)
+        else:
+            name = registry.layers.name_of(layer_type)
+        if not self.layers and name != "input":
             print("First layer must be an input layer!")
             return
-        if 'activation' in kwargs:
-            if kwargs['activation'] == self.SIGMOID:
-                kwargs['activation'] = activation.sigmoid.Sigmoid
-            elif kwargs['activation'] == self.RELU:
-                kwargs['activation'] = activation.relu.ReLU
-        if layer_type == self.INPUT:
-            self.layers.append(
-                layer.input.Input(
-                    **kwargs, name="i{}".format(self.layer_count[layer_type])))
-        elif layer_type == self.DENSE:
-            self.layers.append(
-                layer.dense.Dense(
-                    self.layers[-1],
-                    **kwargs,
-                    name="d{}".format(self.layer_count[layer_type])))
-
-    def train(self, data, labels):
+        self.plan = None
+        kind = kwargs.get('activation')
+        kind = self.ACTIVATIONS.get(kind, kind)
+        if isinstance(kind, str):
+            kwargs['activation'] = registry.activations.get(kind)
+        kwargs.setdefault('dtype', self.dtype)
+        index = self.layer_count.get(name, 0)
+        self.layer_count[name] = index + 1
+        kwargs.setdefault('name', "{}{}".format(name[0], index))
+        if not self.layers:
+            self.layers.append(layer_type(**kwargs))
+        else:
+            kwargs.setdefault('accumulate_dtype', self.accumulate_dtype)
+            self.layers.append(layer_type(self.layers[-1], **kwargs))
+        if self.profiler is not None:
+            self.profiler.attach(self)
+
+    def compile(self, batch_size=32, checkpoints=None, memory_budget=None):
+        """
+        Compiles the layer chain into a flat execution plan, with buffers for
+        batches of up to batch_size samples, which train then uses instead of
+        recursing through the layers. Adding a layer drops the plan.
+
+        To bound the training memory, the plan can keep only the outputs of
+        some layers and recompute the others during backward propagation,
+        see plan.Plan.
+
+        :param batch_size: Largest expected batch size, larger batches grow
+                           the buffers.
+        :param checkpoints: Indices in layers of the layers whose outputs
+                            are kept.
+        :param memory_budget: Bytes the activations of a batch may use, the
+                              checkpoints are chosen to fit in it.
+        :returns: The plan.
+        """
+        import plan
+        self.plan = plan.Plan(self, batch_size, checkpoints, memory_budget)
+        if self.profiler is not None:
+            self.profiler.attach(self)
+        return self.plan
+
+    def profile(self, profiler=None, **kwargs):
+        """
+        Attaches a profiler to the layers, which times their forward,
+        backward and update steps until it is detached. Layers added and
+        plans compiled in the meantime are profiled too. Used as a context
+        manager it detaches itself at the end:
+
+            with nn.profile() as prof:
+                nn.fit(X, Y)
+            print(prof.report())
+
+        :param profiler: Profiler to attach, by default a new
+                         profiler.Profiler made with the keyword arguments.
+        :returns: The profiler.
+        """
+        if profiler is None:
+            import profiler as profiling
+            profiler = profiling.Profiler(**kwargs)
+        if self.profiler is not None and self.profiler is not profiler:
+            self.profiler.detach()
+        return profiler.attach(self)
+
+    def quantize(self, X, percentile=100.0):
+        """
+        Builds an inference only copy of the network with int8 weights, with
+        the input scale of every layer calibrated on the sample X, see
+        quantize.QuantizedNetwork. The network itself is left as it is.
+
+        :param X: Calibration sample, with the samples along the first axis.
+        :param percentile: Percentile of the absolute layer inputs that is
+                           mapped to the largest int8 value.
+        :returns: The quantized network.
+        """
+        import quantize
+        return quantize.quantize(self, X, percentile)
+
+    def train(self, data, labels, optimizer=None):
         """
         This method implement Stochastic gradient descent. Really it would be
         better to abstractly handle this, and let the user chose the training
         method, but this is easy, and its a first try.
 
         This doesn't actual do the gradient decent, this is only a method to
-        handle a single batch of data. It takes the data, evaluates the loss
-        and gradients for all of the elements of the data, then it averages
-        those gradients and makes the change to the layers. The full decent
-        should be calling this method many many times.
+        handle a single batch of data. The whole (batch, features) array is
+        pushed through the layers at once, so every layer does a single
+        matrix-matrix product for the batch. The gradients are summed over the
+        batch, then averaged when making the change to the layers. The full
+        decent should be calling this method many many times, which is what
+        fit does. If an optimizer is given it applies the update, otherwise
+        the averaged gradient is subtracted directly.
         """
         if self.loss_function is None:
             print("Training requires a loss function!")
             return
-        for iteration in range(len(data)):
-            self.layers[0].load_data(data[iteration])
-            loss = self.loss_function.forward_prop(
-                self.layers[-1].forward_prop(), labels[iteration])
-            self.layers[-1].backward_prop(
-                self.loss_function.backward_prop(loss))
-        self.layers[-1].update_weights(len(data))
+        if self.plan is not None:
+            return self.plan.train(data, labels, optimizer)
+        self.layers[0].load_data(data)
+        loss = self.loss_function.forward_prop(self.layers[-1].forward_prop(),
+                                               labels)
+        self.layers[-1].backward_prop(self.loss_function.backward_prop())
+        self.layers[-1].update_weights(len(data), optimizer)
+        return loss
 
-    def predict(self, X):
+    def fit(self,
+            X,
+            Y=None,
+            epochs=1,
+            batch_size=32,
+            optimizer=None,
+            shuffle=True,
+            checkpoint=None,
+            workers=None,
+            asynchronous=False,
+            verbose=False):
+        """
+        Runs the full gradient descent, calling train on mini-batches of X and
+        Y for the given number of epochs.
+
+        Shuffling is done with an index permutation, so the dataset itself is
+        never copied or reordered. Shuffled batches are gathered into a pair
+        of batch buffers that are reused for every step, and unshuffled
+        batches are just views into X and Y.
+
+        :param X: Input data, with the samples along the first axis, a
+                  sparse matrix, see data.sparse, or an iterable of
+                  (x_batch, y_batch) pairs, like a data.pipeline.Pipeline,
+                  that is iterated once per epoch.
+        :param Y: Matching labels, with the samples along the first axis.
+                  Must be None if X yields the batches.
+        :param epochs: Number of passes over the data.
+        :param batch_size: Number of samples per gradient step.
+        :param optimizer: Optimizer from the optimizer package, used to apply
+                          the updates in place.
+        :param shuffle: Toggles reshuffling of the samples every epoch.
+        :param checkpoint: Path the network is saved to after every epoch.
+        :param workers: Number of worker processes every batch is split
+                        over, see parallel.DataParallel. Only supported for
+                        array data.
+        :param asynchronous: Trains the workers without synchronization
+                             instead, see parallel.Hogwild. The checkpoint
+                             is only saved at the end.
+        :param verbose: Toggles verbose printing.
+        :returns: List with the mean loss of every epoch.
+        """
+        if workers is not None and workers > 1:
+            if sparse.issparse(X):
+                raise ValueError("Sparse data can't be trained in parallel")
+            if Y is None:
+                raise ValueError("Parallel training needs arrays of X and Y")
+            import parallel
+            if asynchronous:
+                trainer = parallel.Hogwild(self, workers, batch_size)
+            else:
+                trainer = parallel.DataParallel(self, workers, batch_size)
+            with trainer:
+                return trainer.fit(X, Y, epochs, optimizer, shuffle,
+                                   checkpoint, verbose)
+        history = []
+        if Y is None:
+            for epoch in range(epochs):
+                total = 0.0
+                count = 0
+                for x_data, y_data in X:
+                    loss = self.train(x_data, y_data, optimizer)
+                    if loss is not None:
+                        total += float(loss) * len(x_data)
+                    count += len(x_data)
+                history.append(total / max(count, 1))
+                if checkpoint is not None:
+                    self.save(checkpoint)
+                if verbose:
+                    print(">> Epoch {}/{} loss {:.4f}".format(
+                        epoch + 1, epochs, history[-1]))
+            return history
+        if sparse.issparse(X):
+            X = sparse.asarray(X)
+        count = len(X)
+        batch_size = min(batch_size, count)
+        if sparse.issparse(X):
+            x_batch = None
+        else:
+            x_batch = np.empty((batch_size, ) + X.shape[1:], dtype=X.dtype)
+        y_batch = np.empty((batch_size, ) + Y.shape[1:], dtype=Y.dtype)
+        for epoch in range(epochs):
+            order = np.random.permutation(count) if shuffle else None
+            total = 0.0
+            for start in range(0, count, batch_size):
+                stop = min(start + batch_size, count)
+                if order is None:
+                    x_data = X[start:stop]
+                    y_data = Y[start:stop]
+                else:
+                    y_data = y_batch[:stop - start]
+                    np.take(Y, order[start:stop], axis=0, out=y_data)
+                    if x_batch is None:
+                        x_data = X[order[start:stop]]
+                    else:
+                        x_data = x_batch[:stop - start]
+                        np.take(X, order[start:stop], axis=0, out=x_data)
+                loss = self.train(x_data, y_data, optimizer)
+                if loss is not None:
+                    total += float(loss) * (stop - start)
+            history.append(total / count)
+            if checkpoint is not None:
+                self.save(checkpoint)
+            if verbose:
+                print(">> Epoch {}/{} loss {:.4f}".format(
+                    epoch + 1, epochs, history[-1]))
+        return history
+
+    def forward(self, X, context=None):
+        """
+        Stateless forward propagation of a single batch, in inference mode.
+        The layers are only read, and their buffers are kept in the context
+        dict, so concurrent calls are safe as long as each uses its own
+        context. The returned scores are a buffer of the context.
+
+        :param X: Input batch, with the samples along the first axis.
+        :param context: Dict for the buffers of the call, reusing it for
+                        batches of the same size avoids allocations.
+        :returns: The scores of the batch.
+        """
+        if context is None:
+            context = {}
+        for lay in self.layers:
+            X = lay.infer(X, context)
+        return X
+
+    def predict(self, X, output="scores", chunk_size=1024):
         """
         This is the end goal. A user would use this function to actually use
         the network, after you train it, you want it to "predict" the label
         for the input. This just handles the forward propagation, and will
         return the scores/probabilities that the network outputs.
+
+        The input is pushed through the layers chunk by chunk, with the layers
+        in inference mode, so nothing is kept for backward propagation and
+        the memory used is bounded by the chunk size. The results are written
+        into a single preallocated output array. All of the buffers belong to
+        the call, so predict can be called from many threads at once.
+
+        :param X: Input data, with the samples along the first axis, a
+                  sparse matrix, see data.sparse, or a single sample.
+        :param output: "scores" for the raw scores, "probs" for the
+                       probabilities from the loss function, or "labels" for
+                       the index of the highest score.
+        :param chunk_size: Number of samples pushed through at once.
+        :returns: The output for every sample.
+        """
+        if np.ndim(X) == 1:
+            return self.predict(X[None], output, chunk_size)[0]
+        if output == "probs" and not hasattr(self.loss_function,
+                                             'probabilities'):
+            print("Probabilities require a softmax loss function!")
+            return None
+        if sparse.issparse(X):
+            X = sparse.asarray(X)
+        count = len(X)
+        context = {}
+        if output == "labels":
+            result = np.empty(count, dtype=np.int64)
+        else:
+            result = np.empty((count, self.layers[-1].output_size),
+                              dtype=self.dtype)
+        for start in range(0, count, chunk_size):
+            stop = min(start + chunk_size, count)
+            scores = self.forward(X[start:stop], context)
+            if output == "labels":
+                np.argmax(scores, axis=-1, out=result[start:stop])
+            elif output == "probs":
+                self.loss_function.probabilities(scores,
+                                                 out=result[start:stop])
+            else:
+                result[start:stop] = scores
+        return result
+
+    def save(self, path):
+        """
+        Saves the architecture and the weights of the network to path, in
+        the binary checkpoint format. The file is written next to path and
+        then renamed, so a checkpoint is never left half written, and
+        processes that have the old file mapped keep their copy. Layers with
+        a config method, like Conv2D, store the arguments it returns.
+
+        :param path: Path of the checkpoint file.
         """
-        self.layers[0].load_data(X)
-        scores = self.layers[-1].forward_prop()
-        # I should convert from the scores to the probabilities
-        return scores
+        layers = []
+        blobs = []
+        offset = 0
+        for lay in self.layers:
+            entry = {"type": registry.layers.name_of(type(lay))}
+            if isinstance(lay, layer.input.Input):
+                entry["shape"] = lay.shape
+                layers.append(entry)
+                continue
+            if hasattr(lay, "config"):
+                entry.update(lay.config())
+            else:
+                entry["neurons"] = lay.output_size
+            if getattr(lay, "activation", None) is not None:
+                entry["activation"] = registry.activations.name_of(
+                    type(lay.activation))
+            for name in ("weights", "bias"):
+                if not hasattr(lay, name):
+                    continue
+                blob = np.ascontiguousarray(getattr(lay, name))
+                entry[name] = {
+                    "offset": offset,
+                    "shape": blob.shape,
+                    "dtype": blob.dtype.str
+                }
+                blobs.append(blob)
+                offset += -(-blob.nbytes // ALIGN) * ALIGN
+            layers.append(entry)
+        header = json.dumps({
+            "dtype": self.dtype.str,
+            "loss": registry.losses.name_of(type(self.loss_function))
+            if self.loss_function is not None else None,
+            "layers": layers
+        }).encode()
+        start = -(-(len(MAGIC) + 8 + len(header)) // ALIGN) * ALIGN
+        with open(path + ".tmp", "wb") as binary_out:
+            binary_out.write(MAGIC + struct.pack("<II", VERSION, len(header)))
+            binary_out.write(header)
+            for blob in blobs:
+                binary_out.seek(start)
+                blob.tofile(binary_out)
+                start += -(-blob.nbytes // ALIGN) * ALIGN
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """
+        Loads a network saved with save. The layer, activation, and loss
+        types are looked up in registry. By default the weights are memory
+        mapped read-only, so loading doesn't read them, and every process
+        loading the same file shares the pages. Such a network can only be
+        used for inference, use mmap_mode="c" for private copy on write
+        pages, or None to read the weights into memory.
+
+        :param path: Path of the checkpoint file.
+        :param mmap_mode: Mode of the weight mapping, "r", "c", or None.
+        :returns: The loaded network.
+        """
+        with open(path, "rb") as binary:
+            magic = binary.read(len(MAGIC))
+            if magic != MAGIC:
+                raise ValueError("{} is not a network checkpoint".format(path))
+            version, size = struct.unpack("<II", binary.read(8))
+            if version == 1:
+                # Version 1 files may have been written before the bias moved
+                # inside the activation, so their weights can give different
+                # outputs
+                raise ValueError(
+                    "{} is a version 1 checkpoint, which may predate"
+                    " act(Wx + b) in Dense, it must be saved again".format(
+                        path))
+            if version != VERSION:
+                raise ValueError(
+                    "Unsupported checkpoint version {}".format(version))
+            header = json.loads(binary.read(size).decode())
+        start = -(-(len(MAGIC) + 8 + size) // ALIGN) * ALIGN
+        if mmap_mode is None:
+            with open(path, "rb") as binary:
+                data = np.frombuffer(bytearray(binary.read()), dtype=np.uint8)
+        else:
+            data = np.memmap(path, dtype=np.uint8, mode=mmap_mode)
+
+        def blob(entry):
+            count = int(np.prod(entry["shape"]))
+            dtype = np.dtype(entry["dtype"])
+            offset = start + entry["offset"]
+            return data[offset:offset + count * dtype.itemsize].view(
+                dtype).reshape(entry["shape"])
+
+        loss_function = None
+        if header["loss"] is not None:
+            loss_function = registry.losses.get(header["loss"])()
+        network = cls(loss_function=loss_function, dtype=header["dtype"])
+        for entry in header["layers"]:
+            kwargs = {
+                key: tuple(value) if isinstance(value, list) else value
+                for key, value in entry.items()
+                if key not in ("type", "weights", "bias")
+            }
+            if "weights" in entry:
+                kwargs["weight_init"] = blob(entry["weights"])
+                kwargs["bias_init"] = blob(entry["bias"])
+            network.add_layer(entry["type"], **kwargs)
+        return network
 
     def __repr__(self):
         return "[NeuralNetwork {}]".format(len(self.layers))
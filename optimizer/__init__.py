@@ -0,0 +1,15 @@
+"""
+The submodules are imported on first access, e.g. optimizer.sgd, instead of
+globbing and importing the whole directory. The types are looked up by name
+through registry.
+"""
+import importlib
+
+__all__ = ["adam", "sgd"]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module("optimizer.{}".format(name))
+    raise AttributeError("module 'optimizer' has no attribute {!r}".format(
+        name))
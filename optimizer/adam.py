@@ -0,0 +1,63 @@
+"""
+Defines the Adam optimizer
+"""
+
+import numpy as np
+
+
+class Adam(object):
+    """
+    Adam class to apply the averaged gradients of a batch to the parameters
+    of the layers. The moment estimates and a scratch buffer are kept for
+    every parameter, so a step is done entirely in place.
+    """
+
+    def __init__(self,
+                 learning_rate=0.001,
+                 beta1=0.9,
+                 beta2=0.999,
+                 epsilon=1e-8):
+        self.learning_rate = learning_rate
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        self.state = {}
+
+    def __repr__(self):
+        return "<Optimizer.Adam {}>".format(self.learning_rate)
+
+    def update(self, param, grad, count, key=None):
+        """
+        Updates param in place from the gradient summed over count samples.
+        The gradient buffer is used as scratch space, so its contents are
+        overwritten, it is expected to be cleared by the layer afterwards.
+
+        :param key: Key the state of the parameter is kept under, like
+                    (layer, "weights"), so it isn't lost when the layer
+                    replaces the parameter array. The id of param by
+                    default.
+        """
+        if key is None:
+            key = id(param)
+        state = self.state.get(key)
+        if state is None:
+            state = [0, np.zeros_like(param), np.zeros_like(param),
+                     np.zeros_like(param)]
+            self.state[key] = state
+        state[0] += 1
+        step, mean, var, scratch = state
+        grad /= count
+        np.multiply(grad, grad, out=scratch)
+        scratch *= 1.0 - self.beta2
+        var *= self.beta2
+        var += scratch
+        grad *= 1.0 - self.beta1
+        mean *= self.beta1
+        mean += grad
+        rate = self.learning_rate * np.sqrt(1.0 - self.beta2**step) / (
+            1.0 - self.beta1**step)
+        np.sqrt(var, out=scratch)
+        scratch += self.epsilon
+        np.divide(mean, scratch, out=scratch)
+        scratch *= rate
+        param -= scratch
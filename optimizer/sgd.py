@@ -0,0 +1,47 @@
+"""
+Defines stochastic gradient descent optimizer, with optional momentum
+"""
+
+import numpy as np
+
+
+class SGD(object):
+    """
+    SGD class to apply the averaged gradients of a batch to the parameters of
+    the layers. All of the updates are done in place, so a step doesn't
+    allocate any new arrays after the first one.
+    """
+
+    def __init__(self, learning_rate=0.01, momentum=0.0):
+        self.learning_rate = learning_rate
+        self.momentum = momentum
+        self.velocity = {}
+
+    def __repr__(self):
+        return "<Optimizer.SGD {},{}>".format(self.learning_rate,
+                                              self.momentum)
+
+    def update(self, param, grad, count, key=None):
+        """
+        Updates param in place from the gradient summed over count samples.
+        The gradient buffer is used as scratch space, so its contents are
+        overwritten, it is expected to be cleared by the layer afterwards.
+
+        :param key: Key the velocity of the parameter is kept under, like
+                    (layer, "weights"), so it isn't lost when the layer
+                    replaces the parameter array. The id of param by
+                    default.
+        """
+        if key is None:
+            key = id(param)
+        grad *= self.learning_rate / count
+        if not self.momentum:
+            param -= grad
+            return
+        velocity = self.velocity.get(key)
+        if velocity is None:
+            velocity = np.zeros_like(param)
+            self.velocity[key] = velocity
+        velocity *= self.momentum
+        velocity -= grad
+        param += velocity
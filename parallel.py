@@ -0,0 +1,446 @@
+"""
+Defines data parallel training of a network over a pool of worker processes,
+which exchange the parameters and gradients through shared memory.
+"""
+import multiprocessing
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import layer
+
+
+def share(array, copies=None):
+    """
+    Creates a shared memory block holding a copy of array, or copies zeroed
+    arrays of its shape if copies is given.
+
+    :returns: The shared memory block, and the array view of it.
+    """
+    shape = array.shape if copies is None else (copies, ) + array.shape
+    block = shared_memory.SharedMemory(
+        create=True, size=max(1, int(np.prod(shape)) * array.dtype.itemsize))
+    view = np.ndarray(shape, dtype=array.dtype, buffer=block.buf)
+    if copies is None:
+        view[...] = array
+    else:
+        view.fill(0)
+    return block, view
+
+
+def share_parameters(dense):
+    """
+    Moves the weights and biases of the dense and convolution layers into
+    shared memory.
+
+    :returns: The list of shared memory blocks.
+    """
+    blocks = []
+    for lay in dense:
+        for name in ("weights", "bias"):
+            block, view = share(getattr(lay, name))
+            blocks.append(block)
+            setattr(lay, name, view)
+    return blocks
+
+
+def release_parameters(dense, blocks):
+    """
+    Moves the weights and biases of the layers back to private memory,
+    and releases the shared memory blocks.
+    """
+    for lay in dense:
+        lay.weights = np.array(lay.weights)
+        lay.bias = np.array(lay.bias)
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+class DataParallel(object):
+    """
+    Data parallel trainer, which splits every batch over a number of worker
+    processes. The workers are forked once with a replica of the network, the
+    dense weights and biases of which live in shared memory, so the replicas
+    always see the current parameters. Every worker writes its gradients
+    into its own slot of a shared gradient buffer, those are summed by the
+    parent and applied with a single update_weights, which changes the
+    shared parameters in place. Nothing is pickled after the fork.
+
+    If a worker fails, it breaks the barrier, and the step raises a
+    RuntimeError in the parent after stopping the other workers. A step that
+    takes longer than timeout seconds is treated as failed as well, which
+    catches workers that were killed.
+
+    Forking is required, so this is only available on platforms with the
+    fork start method. Use it as a context manager, or call close when done.
+    """
+
+    def __init__(self, network, workers=None, batch_size=32, timeout=600.0):
+        """
+        :param timeout: Seconds the parent waits for the workers to finish
+                        a step.
+        """
+        self.network = network
+        self.workers = workers or multiprocessing.cpu_count()
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.dense = [
+            lay for lay in network.layers
+            if isinstance(lay, (layer.dense.Dense, layer.conv2d.Conv2D))
+        ]
+        self.blocks = share_parameters(self.dense)
+        self.grads = []
+        for lay in self.dense:
+            for name in ("grad_weights", "grad_bias"):
+                block, view = share(getattr(lay, name), self.workers)
+                self.blocks.append(block)
+                self.grads.append(view)
+                setattr(lay, name, view[0])
+        # Command, sample count, and the rank + 1 of a failed worker
+        block, self.control = share(np.zeros(3, dtype=np.int64))
+        self.blocks.append(block)
+        block, self.index = share(np.zeros(batch_size, dtype=np.int64))
+        self.blocks.append(block)
+        block, self.losses = share(np.zeros(self.workers))
+        self.blocks.append(block)
+        self.data = None
+        self.processes = []
+        context = multiprocessing.get_context("fork")
+        self.barrier = context.Barrier(self.workers + 1)
+        self.context = context
+
+    def __repr__(self):
+        return "<Parallel.DataParallel {}>".format(self.workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def start(self, X, Y):
+        """
+        Forks the workers, which inherit X and Y without copying them.
+        """
+        self.stop()
+        self.data = (X, Y)
+        self.control[2] = 0
+        self.barrier.reset()
+        self.processes = [
+            self.context.Process(target=self.work, args=(rank, ), daemon=True)
+            for rank in range(self.workers)
+        ]
+        for process in self.processes:
+            process.start()
+
+    def work(self, rank):
+        """
+        Loop of a worker process, computing the gradients of its part of
+        every batch into its slot of the gradient buffers. An error is
+        recorded in the control block and breaks the barrier before it is
+        raised, so the parent doesn't wait for the step forever.
+        """
+        try:
+            self.run(rank)
+        except threading.BrokenBarrierError:
+            return
+        except BaseException:
+            self.control[2] = rank + 1
+            self.barrier.abort()
+            raise
+
+    def run(self, rank):
+        """
+        Computes the gradients of the steps until the parent stops.
+        """
+        X, Y = self.data
+        network = self.network
+        grads = iter(self.grads)
+        for lay in self.dense:
+            lay.grad_weights = next(grads)[rank]
+            lay.grad_bias = next(grads)[rank]
+        while True:
+            self.barrier.wait()
+            command, count, _ = self.control
+            if not command:
+                return
+            bounds = np.linspace(0, count, self.workers + 1).astype(int)
+            index = self.index[bounds[rank]:bounds[rank + 1]]
+            for lay in self.dense:
+                lay.grad_weights.fill(0.0)
+                lay.grad_bias.fill(0.0)
+            self.losses[rank] = 0.0
+            if len(index):
+                network.layers[0].load_data(np.take(X, index, axis=0))
+                loss = network.loss_function.forward_prop(
+                    network.layers[-1].forward_prop(), np.take(Y, index,
+                                                               axis=0))
+                network.layers[-1].backward_prop(
+                    network.loss_function.backward_prop())
+                self.losses[rank] = loss * len(index)
+            self.barrier.wait()
+
+    def wait(self):
+        """
+        Waits at the barrier with the workers.
+
+        :raises RuntimeError: If a worker failed or the timeout ran out.
+        """
+        try:
+            self.barrier.wait(self.timeout)
+        except threading.BrokenBarrierError:
+            self.fail()
+
+    def fail(self):
+        """
+        Stops the workers after a broken barrier, and raises the error.
+        """
+        self.barrier.abort()
+        processes, self.processes = self.processes, []
+        for process in processes:
+            process.join(1.0)
+        for process in processes:
+            if process.exitcode is None:
+                process.terminate()
+                process.join()
+        rank = int(self.control[2]) - 1
+        if rank < 0:
+            failed = [
+                number for number, process in enumerate(processes)
+                if process.exitcode
+            ]
+            rank = failed[0] if failed else -1
+        if rank < 0:
+            raise RuntimeError(
+                "The workers didn't finish a step in {} seconds".format(
+                    self.timeout))
+        raise RuntimeError("Worker {} failed with exit code {}".format(
+            rank, processes[rank].exitcode))
+
+    def step(self, index, optimizer=None):
+        """
+        Runs one synchronized gradient step over the samples at index.
+
+        :returns: The mean loss of the batch.
+        :raises RuntimeError: If a worker failed.
+        """
+        self.index[:len(index)] = index
+        self.control[:2] = (1, len(index))
+        self.wait()
+        self.wait()
+        for grad in self.grads:
+            for rank in range(1, self.workers):
+                grad[0] += grad[rank]
+        self.network.layers[-1].update_weights(len(index), optimizer)
+        return float(self.losses.sum()) / len(index)
+
+    def fit(self,
+            X,
+            Y,
+            epochs=1,
+            optimizer=None,
+            shuffle=True,
+            checkpoint=None,
+            verbose=False):
+        """
+        Runs the full gradient descent like Network.fit, with every batch
+        split over the worker processes.
+
+        :returns: List with the mean loss of every epoch.
+        """
+        if self.network.loss_function is None:
+            print("Training requires a loss function!")
+            return None
+        self.start(X, Y)
+        count = len(X)
+        history = []
+        for epoch in range(epochs):
+            order = np.random.permutation(count) if shuffle else np.arange(
+                count)
+            total = 0.0
+            for start in range(0, count, self.batch_size):
+                index = order[start:start + self.batch_size]
+                total += self.step(index, optimizer) * len(index)
+            history.append(total / count)
+            if checkpoint is not None:
+                self.network.save(checkpoint)
+            if verbose:
+                print(">> Epoch {}/{} loss {:.4f}".format(
+                    epoch + 1, epochs, history[-1]))
+        return history
+
+    def stop(self):
+        """
+        Stops the worker processes.
+        """
+        if not self.processes:
+            return
+        self.control[0] = 0
+        self.wait()
+        for process in self.processes:
+            process.join()
+        self.processes = []
+
+    def close(self):
+        """
+        Stops the workers, and moves the parameters of the network back to
+        private memory before releasing the shared memory.
+        """
+        self.stop()
+        for lay in self.dense:
+            lay.grad_weights = np.zeros_like(lay.grad_weights)
+            lay.grad_bias = np.zeros_like(lay.grad_bias)
+        self.grads = []
+        self.control = self.index = self.losses = None
+        release_parameters(self.dense, self.blocks)
+        self.blocks = []
+
+
+class Hogwild(object):
+    """
+    Asynchronous trainer, in the style of Hogwild. The dense weights and
+    biases are moved into shared memory, and every worker process trains on
+    its own part of the data, applying the updates of its mini-batches
+    directly to the shared parameters without any locks or barriers.
+
+    The workers count the updates in a shared, unsynchronized version
+    counter, so the staleness of an update is the number of updates other
+    workers made while its gradient was computed. The counter is updated
+    without locks too, so it is an estimate under heavy contention.
+
+    Forking is required, so this is only available on platforms with the
+    fork start method. Use it as a context manager, or call close when done.
+    """
+
+    def __init__(self, network, workers=None, batch_size=32):
+        self.network = network
+        self.workers = workers or multiprocessing.cpu_count()
+        self.batch_size = batch_size
+        self.dense = [
+            lay for lay in network.layers
+            if isinstance(lay, (layer.dense.Dense, layer.conv2d.Conv2D))
+        ]
+        self.blocks = share_parameters(self.dense)
+        block, self.version = share(np.zeros(1, dtype=np.int64))
+        self.blocks.append(block)
+        # Updates, summed staleness, and largest staleness of every worker
+        block, self.counters = share(np.zeros((self.workers, 3),
+                                              dtype=np.int64))
+        self.blocks.append(block)
+        self.losses = None
+        self.stats = None
+
+    def __repr__(self):
+        return "<Parallel.Hogwild {}>".format(self.workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def work(self, rank, X, Y, epochs, optimizer, shuffle):
+        """
+        Loop of a worker process, training on its part of the data.
+        """
+        network = self.network
+        bounds = np.linspace(0, len(X), self.workers + 1).astype(int)
+        part = np.arange(bounds[rank], bounds[rank + 1])
+        counters = self.counters[rank]
+        for epoch in range(epochs):
+            order = np.random.permutation(part) if shuffle else part
+            for start in range(0, len(order), self.batch_size):
+                index = order[start:start + self.batch_size]
+                seen = self.version[0]
+                network.layers[0].load_data(np.take(X, index, axis=0))
+                loss = network.loss_function.forward_prop(
+                    network.layers[-1].forward_prop(), np.take(Y, index,
+                                                               axis=0))
+                network.layers[-1].backward_prop(
+                    network.loss_function.backward_prop())
+                network.layers[-1].update_weights(len(index), optimizer)
+                staleness = self.version[0] - seen
+                self.version[0] += 1
+                counters[0] += 1
+                counters[1] += staleness
+                counters[2] = max(counters[2], staleness)
+                self.losses[rank, epoch] += loss * len(index)
+
+    def fit(self,
+            X,
+            Y,
+            epochs=1,
+            optimizer=None,
+            shuffle=True,
+            checkpoint=None,
+            verbose=False):
+        """
+        Runs the asynchronous training for the given number of epochs. The
+        optimizer is copied into every worker, so optimizer state like the
+        momentum is kept per worker.
+
+        :returns: List with the mean loss of every epoch, the statistics of
+                  the run are kept in stats.
+        :raises RuntimeError: If a worker failed, the checkpoint isn't saved
+                              then.
+        """
+        if self.network.loss_function is None:
+            print("Training requires a loss function!")
+            return None
+        block, self.losses = share(np.zeros((self.workers, epochs)))
+        self.version[0] = 0
+        self.counters.fill(0)
+        context = multiprocessing.get_context("fork")
+        processes = [
+            context.Process(
+                target=self.work,
+                args=(rank, X, Y, epochs, optimizer, shuffle),
+                daemon=True) for rank in range(self.workers)
+        ]
+        begin = time.perf_counter()
+        try:
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            elapsed = time.perf_counter() - begin
+            history = [
+                float(loss) / len(X) for loss in self.losses.sum(axis=0)
+            ]
+        finally:
+            self.losses = None
+            block.close()
+            block.unlink()
+        for rank, process in enumerate(processes):
+            if process.exitcode:
+                raise RuntimeError("Worker {} failed with exit code {}".format(
+                    rank, process.exitcode))
+        updates = int(self.counters[:, 0].sum())
+        self.stats = {
+            "updates": updates,
+            "mean_staleness": float(self.counters[:, 1].sum()) /
+            max(updates, 1),
+            "max_staleness": int(self.counters[:, 2].max()),
+            "samples_per_sec": len(X) * epochs / elapsed,
+            "seconds": elapsed
+        }
+        if checkpoint is not None:
+            self.network.save(checkpoint)
+        if verbose:
+            for epoch, loss in enumerate(history):
+                print(">> Epoch {}/{} loss {:.4f}".format(
+                    epoch + 1, epochs, loss))
+            print("   {}".format(self.stats))
+        return history
+
+    def close(self):
+        """
+        Moves the parameters of the network back to private memory before
+        releasing the shared memory.
+        """
+        self.version = self.counters = None
+        release_parameters(self.dense, self.blocks)
+        self.blocks = []
@@ -0,0 +1,368 @@
+"""
+Defines the flat execution plan a network is compiled to
+"""
+import numpy as np
+
+import layer
+from data.sparse import compact, issparse
+
+
+class DenseOp(object):
+    """
+    Single step of a plan, running the fused matrix product, bias and
+    activation of a dense layer on buffers that are allocated when the plan
+    is built. The bias and activation are applied in place on the product,
+    and only what the activation needs for backward propagation is kept.
+    The parameters are read from the layer on every call, so they can be
+    updated or replaced freely.
+    """
+
+    def __init__(self, dense, batch_size, first, allocate=True,
+                 workspace=None):
+        """
+        :param allocate: Toggles allocating the output and input gradient
+                         buffers, without them they are given on every call.
+        :param workspace: Dict of the temporaries of the activation, which
+                          can be shared by all the ops of a plan, as nothing
+                          in it is kept between calls.
+        """
+        self.layer = dense
+        self.activation = dense.activation
+        self.first = first
+        self.input = None
+        self.columns = None
+        self.saved = None
+        self.workspace = {} if workspace is None else workspace
+        self.out = None
+        self.grad_input = None
+        if allocate:
+            self.out = np.empty((batch_size, dense.output_size),
+                                dtype=dense.dtype)
+            if not first:
+                self.grad_input = np.empty(
+                    (batch_size, dense.weights.shape[1]), dtype=dense.dtype)
+        self.grad_weights = np.empty(dense.weights.shape, dtype=dense.dtype)
+        self.grad_bias = np.empty(dense.bias.shape,
+                                  dtype=dense.accumulate_dtype)
+
+    def __repr__(self):
+        return "<Plan.DenseOp {}>".format(self.layer.name)
+
+    def forward(self, X, out=None):
+        weights = self.layer.weights
+        self.columns = None
+        if issparse(X):
+            self.columns, X = compact(X, self.layer.dtype)
+            weights = weights.take(self.columns, axis=1)
+        elif X.ndim > 2:
+            X = X.reshape(len(X), -1)
+        out = (self.out if out is None else out)[:len(X)]
+        np.matmul(X, weights.T, out=out)
+        np.add(out, self.layer.bias, out=out)
+        if self.activation:
+            self.saved = self.activation.activate(out, self.workspace)
+        self.input = X
+        return out
+
+    def backward(self, dD, grad_input=None):
+        dense = self.layer
+        if self.activation:
+            dD = self.activation.chain(self.saved, dD, self.workspace)
+        dense.grad_bias += dD.sum(axis=0,
+                                  dtype=dense.accumulate_dtype,
+                                  out=self.grad_bias)
+        if self.columns is not None:
+            dense.accumulate_columns(self.columns, dD, self.input)
+            return None
+        dense.dense_gradients = True
+        dense.grad_weights += np.matmul(dD.T,
+                                        self.input,
+                                        out=self.grad_weights)
+        if self.first:
+            return None
+        if grad_input is None:
+            grad_input = self.grad_input
+        return np.matmul(dD, dense.weights, out=grad_input[:len(dD)])
+
+
+def view(flat, rows, columns, offset=0):
+    """
+    :returns: (rows, columns) view of the flat buffer, starting at offset.
+    """
+    return flat[offset:offset + rows * columns].reshape(rows, columns)
+
+
+def choose_checkpoints(sizes, budget, fixed=0):
+    """
+    Chooses the checkpoints of a chain of layers, so that the kept outputs
+    and the largest segment fit in the budget.
+
+    Every segment but the last is run forward a second time, so the extra
+    work is the forward pass of the layers before the last segment. The last
+    segment is made as long as the budget allows, and the layers before it
+    are split to keep the fewest bytes for that.
+
+    :param sizes: Bytes of the output of every layer.
+    :param budget: Bytes the activations may use.
+    :param fixed: Bytes of the budget used whatever the checkpoints are.
+    :returns: Sorted indices of the layers whose outputs are kept, empty if
+              every output fits.
+    :raises ValueError: If no choice of checkpoints fits the budget.
+    """
+    count = len(sizes)
+    budget -= fixed
+    prefix = np.concatenate(([0], np.cumsum(sizes))).tolist()
+    smallest = None
+    for last in range(count):
+        tail = prefix[count] - prefix[last]
+        if last == 0:
+            if tail <= budget:
+                return []
+            smallest = tail
+            continue
+        caps = sorted(
+            set(prefix[stop] - prefix[begin] for begin in range(last)
+                for stop in range(begin + 1, last + 1)
+                if prefix[stop] - prefix[begin] >= tail) | {tail})
+        for cap in caps:
+            # kept[i] is the fewest bytes kept for the first i layers with
+            # a checkpoint at layer i - 1, and parts[i] the segment start
+            kept = [0] + [None] * last
+            parts = [0] * (last + 1)
+            for stop in range(1, last + 1):
+                for begin in range(stop - 1, -1, -1):
+                    if prefix[stop] - prefix[begin] > cap:
+                        break
+                    if kept[begin] is not None and (
+                            kept[stop] is None
+                            or kept[begin] + sizes[stop - 1] < kept[stop]):
+                        kept[stop] = kept[begin] + sizes[stop - 1]
+                        parts[stop] = begin
+            if kept[last] is None:
+                continue
+            total = kept[last] + cap
+            smallest = total if smallest is None else min(smallest, total)
+            if total <= budget:
+                chosen = []
+                stop = last
+                while stop > 0:
+                    chosen.append(stop - 1)
+                    stop = parts[stop]
+                return sorted(chosen)
+    raise ValueError(
+        "The activations need at least {} bytes, the budget is {}".format(
+            smallest + fixed, budget + fixed))
+
+
+class Plan(object):
+    """
+    Flat execution plan of a network. The layer chain is turned into a list
+    of ops with known shapes and preallocated buffers for batches of up to
+    batch_size samples, which are run by plain loops forward and backward,
+    instead of recursing through the layers.
+
+    With checkpoints, only the outputs of the checkpoint layers are kept
+    from the forward pass, the other layers write into shared scratch
+    buffers. The layers after a checkpoint, up to the next one, form a
+    segment, which is run forward again from that checkpoint right before
+    its backward propagation. The last segment is kept from the forward
+    pass, so at most one extra forward pass is spent per batch, and the
+    activation memory is the kept outputs plus the largest segment. The
+    input gradients share two buffers as well.
+
+    The activations only keep their outputs, and the temporaries of all of
+    them share one workspace, which is counted in memory and the budget.
+
+    A plan keeps the state of the last batch in its buffers, so it must not
+    be shared between threads, use Network.predict for concurrent inference.
+    """
+
+    def __init__(self,
+                 network,
+                 batch_size=32,
+                 checkpoints=None,
+                 memory_budget=None):
+        """
+        :param checkpoints: Indices in network.layers of the dense layers
+                            whose outputs are kept, the last layer is never
+                            one. None keeps every output.
+        :param memory_budget: Bytes the activations of a batch may use, the
+                              checkpoints are then chosen to fit it. The
+                              parameters and their gradients aren't counted.
+        """
+        if not network.layers or not isinstance(network.layers[0],
+                                                layer.input.Input):
+            raise ValueError("First layer must be an input layer!")
+        self.network = network
+        self.input = network.layers[0]
+        self.memory_budget = memory_budget
+        for lay in network.layers[1:]:
+            if not isinstance(lay, layer.dense.Dense):
+                raise ValueError("Can't compile layer {}".format(lay))
+        self.requested = checkpoints
+        self.build(batch_size)
+
+    def build(self, batch_size):
+        """
+        Allocates the buffers and ops for batches of up to batch_size rows,
+        choosing the checkpoints again when there is a memory budget.
+
+        :param batch_size: Largest batch the buffers hold.
+        """
+        self.batch_size = batch_size
+        layers = self.network.layers[1:]
+        checkpoints = self.requested
+        memory_budget = self.memory_budget
+        itemsize = max(lay.dtype.itemsize for lay in layers)
+        sizes = [batch_size * lay.output_size * itemsize for lay in layers]
+        widest = max(lay.output_size for lay in layers)
+        inputs = max(lay.weights.shape[1] for lay in layers)
+        # Shared activation temporaries, which are allocated once for every
+        # activation type and layer shape
+        self.workspace = {}
+        self.rows = None
+        shapes = {}
+        for lay in layers:
+            if lay.activation:
+                shapes[(type(lay.activation), lay.output_size,
+                        lay.dtype)] = lay.activation
+        self.workspace_bytes = sum(
+            activation.workspace_bytes((batch_size, size), dtype)
+            for (_, size, dtype), activation in shapes.items())
+        # Forward scratch and input gradient buffers, two of each
+        scratch = 2 * batch_size * (widest + inputs) * itemsize
+        if memory_budget is not None:
+            checkpoints = [
+                index + 1
+                for index in choose_checkpoints(
+                    sizes, memory_budget, scratch + self.workspace_bytes)
+            ]
+        self.checkpoints = None
+        if checkpoints is not None:
+            self.checkpoints = sorted(set(checkpoints))
+            if any(index < 1 or index >= len(layers)
+                   for index in self.checkpoints):
+                raise ValueError(
+                    "Checkpoints must be layers before the last one")
+        self.ops = [
+            DenseOp(lay, batch_size, not index, self.checkpoints is None,
+                    self.workspace) for index, lay in enumerate(layers)
+        ]
+        self.segments = None
+        self.recompute_flops = 0
+        if self.checkpoints is None:
+            self.memory = sum(sizes) + sum(
+                op.grad_input.nbytes
+                for op in self.ops[1:]) + self.workspace_bytes
+            return
+        bounds = [0] + self.checkpoints + [len(self.ops)]
+        self.segments = list(zip(bounds[:-1], bounds[1:]))
+        dtype = np.result_type(*[lay.dtype for lay in layers])
+        self.kept = {
+            index - 1: np.empty((batch_size, layers[index - 1].output_size),
+                                dtype=dtype)
+            for index in self.checkpoints
+        }
+        pool = max(sum(sizes[begin:stop]) for begin, stop in self.segments)
+        self.pool = np.empty(pool // itemsize, dtype=dtype)
+        self.scratch = [
+            np.empty(batch_size * widest, dtype=dtype) for _ in range(2)
+        ]
+        self.grads = [
+            np.empty(batch_size * inputs, dtype=dtype) for _ in range(2)
+        ]
+        self.batch = None
+        self.memory = sum(sizes[index - 1] for index in self.checkpoints
+                          ) + pool + scratch + self.workspace_bytes
+        if self.checkpoints:
+            self.recompute_flops = sum(
+                2 * batch_size * lay.weights.size
+                for lay in layers[:self.checkpoints[-1]])
+
+    def __repr__(self):
+        return "<Plan {},{}>".format(self.batch_size, self.ops)
+
+    def segment_buffer(self, index, start):
+        """
+        :returns: Output buffer of op index in the segment starting at op
+                  start.
+        """
+        offset = self.batch_size * sum(op.layer.output_size
+                                       for op in self.ops[start:index])
+        return view(self.pool, self.batch_size,
+                    self.ops[index].layer.output_size, offset)
+
+    def forward(self, X):
+        """
+        Runs the forward propagation of a batch, keeping what the backward
+        propagation needs in the buffers. The returned scores are a buffer.
+        """
+        if len(X) > self.batch_size:
+            self.build(len(X))
+            if self.network.profiler is not None:
+                self.network.profiler.attach(self.network)
+        X = self.input.infer(X)
+        if len(X) != self.rows:
+            # The temporaries are kept for one batch size only
+            self.workspace.clear()
+            self.rows = len(X)
+        if self.segments is None:
+            for op in self.ops:
+                X = op.forward(X)
+            return X
+        self.batch = X
+        last = self.segments[-1][0]
+        for index, op in enumerate(self.ops):
+            if index >= last:
+                out = self.segment_buffer(index, last)
+            elif index in self.kept:
+                out = self.kept[index]
+            else:
+                out = view(self.scratch[index % 2], self.batch_size,
+                           op.layer.output_size)
+            X = op.forward(X, out)
+        return X
+
+    def backward(self, dD):
+        """
+        Runs the backward propagation of the gradient of the scores of the
+        last forward batch, accumulating the gradients of the layers. With
+        checkpoints, every segment but the last is run forward again first.
+        """
+        if self.segments is None:
+            for op in reversed(self.ops):
+                dD = op.backward(dD)
+            return
+        rows = len(dD)
+        for number in range(len(self.segments) - 1, -1, -1):
+            start, stop = self.segments[number]
+            if number < len(self.segments) - 1:
+                X = self.batch if start == 0 else self.kept[start - 1][:rows]
+                for index in range(start, stop):
+                    X = self.ops[index].forward(
+                        X, self.segment_buffer(index, start))
+            for index in range(stop - 1, start - 1, -1):
+                op = self.ops[index]
+                grad_input = None if op.first else view(
+                    self.grads[index % 2], self.batch_size,
+                    op.layer.weights.shape[1])
+                dD = op.backward(dD, grad_input)
+
+    def update(self, count, optimizer=None):
+        """
+        Applies the gradients accumulated over count samples to every layer.
+        """
+        for op in self.ops:
+            op.layer.apply_gradients(count, optimizer)
+
+    def train(self, data, labels, optimizer=None):
+        """
+        Runs a single training step on a batch, like Network.train.
+
+        :returns: The loss of the batch.
+        """
+        loss_function = self.network.loss_function
+        loss = loss_function.forward_prop(self.forward(data), labels)
+        self.backward(loss_function.backward_prop())
+        self.update(len(data), optimizer)
+        return loss
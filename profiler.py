@@ -0,0 +1,290 @@
+"""
+Defines opt-in per-layer profiling of the forward, backward and update steps
+of a network, with JSON and Chrome trace exports
+"""
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+
+class Profiler(object):
+    """
+    Profiler that times every layer of a network. Attaching it wraps the
+    forward_prop, infer, backward_prop and apply_gradients methods of the
+    layers, the forward and backward of the ops of a compiled plan, and the
+    loss function, by setting the wrappers on the instances. Detaching it
+    deletes them again, so a network that isn't being profiled runs the
+    plain methods and pays nothing.
+
+    Every call is recorded as an event with the layer name, the phase, the
+    total and self seconds (without the time spent in the source layers the
+    recursive methods call), the flops and bytes from the cost method of the
+    layer if it has one, and the bytes allocated during the call if
+    allocation tracking is on. The events are aggregated per layer and phase,
+    passed to the callbacks, and kept for the trace exports if trace is set.
+
+    Only the process that attached it is profiled, the workers of
+    parallel.DataParallel and parallel.Hogwild record into their own copies.
+    """
+
+    # Methods wrapped on every object, with the phase they are recorded as
+    PHASES = {
+        "forward_prop": "forward",
+        "infer": "infer",
+        "backward_prop": "backward",
+        "apply_gradients": "update",
+        "forward": "forward",
+        "backward": "backward",
+    }
+
+    def __init__(self,
+                 callbacks=None,
+                 trace=True,
+                 max_events=1000000,
+                 allocations=False):
+        """
+        :param callbacks: Functions called with every event dict.
+        :param trace: Toggles keeping the events for the trace exports.
+        :param max_events: Largest number of events kept, later events are
+                           still aggregated and passed to the callbacks.
+        :param allocations: Toggles tracking the bytes allocated per call
+                            with tracemalloc, which slows everything down.
+        """
+        self.callbacks = list(callbacks) if callbacks else []
+        self.trace = trace
+        self.max_events = max_events
+        self.allocations = allocations
+        self.network = None
+        self.wrapped = {}
+        self.events = []
+        self.totals = {}
+        self.local = threading.local()
+        self.started_tracing = False
+        self.origin = time.perf_counter()
+
+    def __repr__(self):
+        return "<Profiler {} events,{} wrapped>".format(
+            len(self.events), len(self.wrapped))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.detach()
+
+    def attach(self, network):
+        """
+        Wraps the layers, the plan ops and the loss function of the network.
+        Objects that are already wrapped are skipped, so it can be called
+        again after layers are added or the network is compiled, which
+        Network does itself while the profiler is attached.
+
+        :param network: Network to profile.
+        :returns: The profiler.
+        """
+        self.network = network
+        network.profiler = self
+        if self.allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        for lay in network.layers:
+            self.wrap(lay, lay.name, lay)
+        if network.plan is not None:
+            for op in network.plan.ops:
+                self.wrap(op, op.layer.name, op.layer, op.first)
+        if network.loss_function is not None:
+            self.wrap(network.loss_function,
+                      type(network.loss_function).__name__.lower(), None)
+        return self
+
+    def detach(self):
+        """
+        Restores the plain methods on every wrapped object.
+        """
+        for obj, names in self.wrapped.values():
+            for name in names:
+                obj.__dict__.pop(name, None)
+        self.wrapped = {}
+        if self.network is not None and self.network.profiler is self:
+            self.network.profiler = None
+        self.network = None
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def wrap(self, obj, name, layer, first=False):
+        """
+        Sets timed wrappers of the methods in PHASES that obj has.
+
+        :param obj: Layer, plan op or loss function.
+        :param name: Name the events are recorded under.
+        :param layer: Object the cost method is looked up on, if any.
+        :param first: Whether obj is the first op of a plan, which doesn't
+                      compute the gradient of its input.
+        """
+        if id(obj) in self.wrapped:
+            return
+        cost = getattr(layer, "cost", None)
+        names = []
+        for method, phase in self.PHASES.items():
+            if callable(getattr(obj, method, None)):
+                setattr(obj, method,
+                        self.timed(getattr(obj, method), name, phase, cost,
+                                   not first))
+                names.append(method)
+        self.wrapped[id(obj)] = (obj, names)
+
+    def timed(self, method, name, phase, cost, grad_input):
+        """
+        :returns: Wrapper of the bound method that records an event for
+                  every call.
+        """
+        clock = time.perf_counter
+        local = self.local
+
+        def wrapper(*args, **kwargs):
+            stack = getattr(local, "stack", None)
+            if stack is None:
+                stack = local.stack = []
+            stack.append(0.0)
+            allocated = self.allocated()
+            start = clock()
+            try:
+                result = method(*args, **kwargs)
+            finally:
+                seconds = clock() - start
+                children = stack.pop()
+                if stack:
+                    stack[-1] += seconds
+            if self.allocations:
+                allocated = self.allocated() - allocated
+            if phase == "update":
+                batch = 0
+            elif args and hasattr(args[0], "shape"):
+                batch = len(args[0])
+            else:
+                batch = len(result) if hasattr(result, "shape") else 0
+            flops, moved = cost(phase, batch, grad_input) if cost else (0, 0)
+            self.record({
+                "name": name,
+                "phase": phase,
+                "start": start - self.origin,
+                "seconds": seconds,
+                "self_seconds": seconds - children,
+                "batch": batch,
+                "flops": flops,
+                "bytes": moved,
+                "allocated": allocated,
+                "thread": threading.get_ident(),
+            })
+            return result
+
+        return wrapper
+
+    def allocated(self):
+        if self.allocations and tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[0]
+        return 0
+
+    def record(self, event):
+        """
+        Aggregates the event, passes it to the callbacks, and keeps it if
+        tracing.
+        """
+        key = (event["name"], event["phase"])
+        total = self.totals.get(key)
+        if total is None:
+            total = self.totals[key] = {
+                "calls": 0, "seconds": 0.0, "self_seconds": 0.0,
+                "samples": 0, "flops": 0, "bytes": 0, "allocated": 0}
+        total["calls"] += 1
+        total["seconds"] += event["seconds"]
+        total["self_seconds"] += event["self_seconds"]
+        total["samples"] += event["batch"]
+        total["flops"] += event["flops"]
+        total["bytes"] += event["bytes"]
+        total["allocated"] += event["allocated"]
+        if self.trace and len(self.events) < self.max_events:
+            self.events.append(event)
+        for callback in self.callbacks:
+            callback(event)
+
+    def reset(self):
+        """
+        Drops the recorded events and totals.
+        """
+        self.events = []
+        self.totals = {}
+        self.origin = time.perf_counter()
+
+    def summary(self):
+        """
+        :returns: List of the totals per layer and phase, sorted by self
+                  seconds, with the achieved flop and byte rates.
+        """
+        rows = []
+        for (name, phase), total in self.totals.items():
+            row = dict(total, name=name, phase=phase)
+            seconds = total["self_seconds"]
+            row["gflops"] = total["flops"] / seconds * 1e-9 if seconds else 0.0
+            row["gbytes_per_sec"] = (total["bytes"] / seconds *
+                                     1e-9 if seconds else 0.0)
+            rows.append(row)
+        rows.sort(key=lambda row: row["self_seconds"], reverse=True)
+        return rows
+
+    def report(self):
+        """
+        :returns: Table of the summary as text.
+        """
+        lines = ["{:<12} {:<8} {:>8} {:>10} {:>10} {:>8} {:>8}".format(
+            "layer", "phase", "calls", "total ms", "self ms", "GFLOP/s",
+            "GB/s")]
+        for row in self.summary():
+            lines.append(
+                "{:<12} {:<8} {:>8d} {:>10.3f} {:>10.3f} {:>8.2f} {:>8.2f}"
+                .format(str(row["name"]), row["phase"], row["calls"],
+                        row["seconds"] * 1e3, row["self_seconds"] * 1e3,
+                        row["gflops"], row["gbytes_per_sec"]))
+        return "\n".join(lines)
+
+    def write_json(self, path, events=False):
+        """
+        Writes the summary, and the events if asked, as JSON.
+
+        :param path: File to write.
+        :param events: Toggles including every kept event.
+        """
+        report = {"summary": self.summary()}
+        if events:
+            report["events"] = self.events
+        with open(path, "w") as json_out:
+            json.dump(report, json_out, indent=2)
+
+    def write_chrome_trace(self, path):
+        """
+        Writes the kept events in the Chrome trace event format, which can be
+        opened in chrome://tracing or Perfetto. The recursive calls nest, so
+        each layer shows up inside the layer that called it.
+
+        :param path: File to write.
+        """
+        trace = []
+        pid = os.getpid()
+        for event in self.events:
+            trace.append({
+                "name": "{} {}".format(event["name"], event["phase"]),
+                "cat": event["phase"],
+                "ph": "X",
+                "ts": event["start"] * 1e6,
+                "dur": event["seconds"] * 1e6,
+                "pid": pid,
+                "tid": event["thread"],
+                "args": {name: event[name]
+                         for name in ("batch", "flops", "bytes", "allocated")},
+            })
+        with open(path, "w") as trace_out:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"},
+                      trace_out)
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Post-training int8 quantization of dense networks, for inference only.
+
+    python quantize.py model.nn [--data mnist] [--samples 1000] [--json]
+
+The weights of every dense layer are stored as int8 with one scale per row,
+and the input of every layer is quantized to int8 with a single scale found
+by calibration on a sample of the data. The products are summed exactly as
+int32, then dequantized, biased and activated as float32. The command line
+calibrates a saved network on a sample of the MNIST validation set or of a
+CIFAR10 training batch, and reports the accuracy of the int8 network against
+the float one on the test set.
+
+The int8 network only saves memory, its weights are a quarter of the size of
+float32 weights. numpy has no integer matrix product that uses BLAS, so the
+products are float32 ones on weights converted on every call, which makes
+the int8 network slower than the same network in float32. The report
+compares the size and the speed with a float32 copy of the network, and the
+prediction server only serves float networks for that reason.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+import buffers
+import layer
+from data.sparse import issparse
+
+# Largest number of int8 products whose sum is exact in float32, as
+# EXACT * 127 * 127 is below 2 ** 24.
+EXACT = 1040
+# Rows of the int8 weights converted to float32 at once.
+TILE = 256
+# Data set files the command line calibrates and evaluates on
+CALIBRATION = {"mnist": "validation", "cifar10": "data_batch_5"}
+EVALUATION = {"mnist": "testing", "cifar10": "test_batch"}
+
+
+def quantize_rows(weights):
+    """
+    Symmetric per-row quantization, every row is scaled so that its largest
+    absolute value is 127.
+
+    :param weights: (outputs, inputs) float array.
+    :returns: Tuple of the int8 weights and the float32 scale of every row.
+    """
+    weights = np.asarray(weights)
+    scales = np.abs(weights).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.rint(weights / scales[:, None])
+    np.clip(quantized, -127, 127, out=quantized)
+    return quantized.astype(np.int8), scales.astype(np.float32)
+
+
+class QuantizedDense(object):
+    """
+    Inference only copy of a dense layer, with int8 weights and per-row
+    scales. The input is quantized with the calibrated input scale, and the
+    int8 products are summed as int32.
+
+    numpy has no integer matrix product that uses BLAS, its int32 matmul is
+    tens of times slower than the float32 one, so the sums are computed by
+    float32 products of int8 values over blocks of at most EXACT inputs,
+    which are exact, and added up as int32 if there are several blocks. The
+    weights are converted to float32 TILE rows at a time, so only the int8
+    weights are kept, at the cost of the conversion on every call.
+    """
+
+    def __init__(self, dense, input_scale):
+        """
+        :param dense: Trained Dense layer, which is only read.
+        :param input_scale: Value of one step of the quantized input, see
+                            calibrate.
+        """
+        self.source_layer = None
+        self.name = dense.name
+        self.activation = dense.activation
+        self.output_size = dense.output_size
+        self.input_scale = float(input_scale)
+        self.weights, self.scales = quantize_rows(dense.weights)
+        self.bias = np.asarray(dense.bias, dtype=np.float32)
+        # Dequantization factor of every output
+        self.factor = (self.scales * self.input_scale).astype(np.float32)
+        self.dtype = np.dtype(np.float32)
+        self.workspace = {}
+
+    def __repr__(self):
+        return "<Layer.QuantizedDense({}) {},{}>".format(
+            self.name, self.output_size, self.activation)
+
+    def buffer(self, name, shape, dtype, workspace=None):
+        """
+        :returns: The buffers.get array of the given workspace dict, or of
+                  the workspace of the layer.
+        """
+        return buffers.get(self.workspace if workspace is None else workspace,
+                           name, shape, dtype)
+
+    def quantize_input(self, X, workspace=None):
+        """
+        :returns: The (batch, inputs) int8 values of X, rounded and clipped
+                  to [-127, 127], held as float32 in a workspace buffer.
+        """
+        Xq = self.buffer('input', X.shape, np.float32, workspace)
+        np.multiply(X, 1.0 / self.input_scale, out=Xq, casting='same_kind')
+        np.rint(Xq, out=Xq)
+        return np.clip(Xq, -127, 127, out=Xq)
+
+    def product(self, Xq, workspace=None):
+        """
+        Computes the exact integer product of the quantized input and the
+        int8 weights.
+
+        :returns: The (batch, outputs) sums, which are float32 if the inputs
+                  fit in one block, and int32 otherwise, in a workspace
+                  buffer.
+        """
+        batch, inputs = Xq.shape
+        outputs = self.output_size
+        tile = self.buffer('tile', (min(TILE, outputs), min(EXACT, inputs)),
+                           np.float32, workspace)
+        partial = self.buffer('partial', (batch, outputs), np.float32,
+                              workspace)
+        total = None
+        if inputs > EXACT:
+            total = self.buffer('total', (batch, outputs), np.int32,
+                                workspace)
+            total.fill(0)
+        for begin in range(0, inputs, EXACT):
+            end = min(begin + EXACT, inputs)
+            for first in range(0, outputs, TILE):
+                last = min(first + TILE, outputs)
+                weights = tile[:last - first, :end - begin]
+                np.copyto(weights,
+                          self.weights[first:last, begin:end],
+                          casting='unsafe')
+                np.matmul(Xq[:, begin:end],
+                          weights.T,
+                          out=partial[:, first:last])
+            if total is None:
+                return partial
+            np.add(total, partial, out=total, casting='unsafe')
+        return total
+
+    def infer(self, X, context=None):
+        """
+        Inference mode forward propagation of X, like Dense.infer. The
+        returned array is a float32 workspace buffer.
+        """
+        workspace = None
+        if context is not None:
+            workspace = context.setdefault(id(self), {})
+        if issparse(X):
+            X = X.toarray()
+        X = np.asarray(X)
+        if X.ndim > 2:
+            X = X.reshape(len(X), -1)
+        sums = self.product(self.quantize_input(X, workspace), workspace)
+        out = self.buffer('infer', sums.shape, np.float32, workspace)
+        np.multiply(sums, self.factor, out=out, casting='same_kind')
+        np.add(out, self.bias, out=out)
+        if self.activation:
+            if context is not None:
+                workspace = context.setdefault(id(self.activation), {})
+            self.activation.infer(out, out=out, workspace=workspace)
+        return out
+
+    @property
+    def nbytes(self):
+        return self.weights.nbytes + self.scales.nbytes + self.bias.nbytes
+
+
+def calibrate(network, X, percentile=100.0, chunk_size=1024):
+    """
+    Finds the input scale of every dense layer, from the float inference of
+    a sample of the data.
+
+    :param network: Network of an input layer and dense layers.
+    :param X: Calibration sample, with the samples along the first axis.
+    :param percentile: Percentile of the absolute inputs mapped to 127,
+                       values above it are clipped. 100 uses the maximum.
+    :param chunk_size: Number of samples pushed through at once.
+    :returns: List of the input scale of every dense layer.
+    """
+    layers = network.layers[1:]
+    for lay in layers:
+        if not isinstance(lay, layer.dense.Dense):
+            raise ValueError("Can't quantize layer {}".format(lay))
+    values = [[] for _ in layers]
+    context = {}
+    for start in range(0, len(X), chunk_size):
+        inputs = network.layers[0].infer(X[start:start + chunk_size])
+        for index, lay in enumerate(layers):
+            magnitude = np.abs(np.reshape(inputs, (len(inputs), -1)))
+            if percentile >= 100:
+                values[index].append(np.max(magnitude))
+            else:
+                values[index].append(np.percentile(magnitude, percentile))
+            inputs = lay.infer(inputs, context)
+    # The chunks are combined by their largest value
+    return [max(float(np.max(value)), np.finfo(np.float32).tiny) / 127.0
+            for value in values]
+
+
+class QuantizedNetwork(object):
+    """
+    Inference only int8 copy of a dense network, built by quantize. It has
+    the forward and predict methods of Network, so it can be used in its
+    place for scoring, e.g. by server.MicroBatcher.
+    """
+
+    def __init__(self, network, scales):
+        """
+        :param network: Network of an input layer and dense layers.
+        :param scales: Input scale of every dense layer, from calibrate.
+        """
+        self.loss_function = network.loss_function
+        self.dtype = np.dtype(np.float32)
+        self.scales = list(scales)
+        self.layers = [network.layers[0]] + [
+            QuantizedDense(lay, scale)
+            for lay, scale in zip(network.layers[1:], self.scales)
+        ]
+
+    def __repr__(self):
+        return "<QuantizedNetwork {}>".format(self.layers)
+
+    def forward(self, X, context=None):
+        """
+        Stateless forward propagation of a single batch, like
+        Network.forward.
+        """
+        if context is None:
+            context = {}
+        for lay in self.layers:
+            X = lay.infer(X, context)
+        return X
+
+    def predict(self, X, output="scores", chunk_size=1024):
+        """
+        Predicts the output of every sample of X, like Network.predict.
+        """
+        from network import Network
+        return Network.predict(self, X, output, chunk_size)
+
+    @property
+    def nbytes(self):
+        return sum(lay.nbytes for lay in self.layers[1:])
+
+
+def quantize(network, X, percentile=100.0):
+    """
+    :param network: Trained network of an input layer and dense layers.
+    :param X: Calibration sample, a few hundred samples are usually enough.
+    :param percentile: Percentile of the absolute inputs mapped to 127.
+    :returns: The QuantizedNetwork of the network.
+    """
+    return QuantizedNetwork(network, calibrate(network, X, percentile))
+
+
+def load_sample(dataset, file, count=None, seed=0):
+    """
+    Loads a random sample of a data set from its memory mapped cache, with
+    the images as float32 in the scale of the data set loaders.
+
+    :param dataset: "mnist" or "cifar10".
+    :param file: Data set or batch, as given to the load function of the
+                 data set.
+    :param count: Number of samples, all of them by default.
+    :param seed: Seed of the sample.
+    :returns: A pair of the images and the int64 labels.
+    """
+    if dataset == "mnist":
+        from data import mnist
+        X, Y = mnist.load(file,
+                          flatten=True,
+                          verbose=False,
+                          mmap=True,
+                          raw=True)
+    elif dataset == "cifar10":
+        from data import cifar10
+        X, Y = cifar10.load(file, verbose=False, mmap=True, raw=True)
+    else:
+        raise ValueError("Unknown data set {}".format(dataset))
+    rows = np.arange(len(X))
+    if count is not None and count < len(X):
+        rows = np.sort(
+            np.random.RandomState(seed).choice(len(X), count, replace=False))
+    if dataset == "mnist":
+        return mnist.from_cache(X[rows], np.float32), np.asarray(Y[rows])
+    return X[rows].astype(np.float32), np.asarray(Y[rows])
+
+
+def float32_copy(network):
+    """
+    :returns: Copy of a network of an input layer and dense layers, with
+              float32 parameters.
+    """
+    from network import Network
+    copy = Network(loss_function=network.loss_function, dtype=np.float32)
+    copy.add_layer("input", shape=network.layers[0].shape)
+    for lay in network.layers[1:]:
+        copy.add_layer("dense",
+                       neurons=lay.output_size,
+                       activation=type(lay.activation)
+                       if lay.activation else None,
+                       weight_init=np.asarray(lay.weights),
+                       bias_init=np.asarray(lay.bias),
+                       name=lay.name)
+    return copy
+
+
+def samples_per_second(model, X, repeat=3):
+    """
+    :returns: The best samples/sec of model.predict on X out of repeat runs.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        model.predict(X)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return len(X) / best
+
+
+def report(network, quantized, X, Y):
+    """
+    Compares the int8 network with the float network it was built from,
+    and with a float32 copy of it, which is the alternative for serving.
+
+    :param X: Evaluation data.
+    :param Y: Labels, or one-hot scores, of the evaluation data.
+    :returns: Dict of the accuracy of both networks, how often their labels
+              agree, the largest difference of their scores, and the bytes
+              of the parameters and the predict samples/sec of the int8 and
+              the float32 networks.
+    """
+    labels = np.argmax(Y, axis=-1) if np.ndim(Y) > 1 else np.asarray(Y)
+    expected = network.predict(X)
+    scores = quantized.predict(X)
+    float_labels = np.argmax(expected, axis=-1)
+    int8_labels = np.argmax(scores, axis=-1)
+    reference = float32_copy(network)
+    return {
+        "samples": len(X),
+        "float_accuracy": float(np.mean(float_labels == labels)),
+        "int8_accuracy": float(np.mean(int8_labels == labels)),
+        "agreement": float(np.mean(float_labels == int8_labels)),
+        "max_score_difference": float(np.max(np.abs(scores - expected))),
+        "float32_bytes": int(
+            sum(lay.weights.nbytes + lay.bias.nbytes
+                for lay in reference.layers[1:])),
+        "int8_bytes": int(quantized.nbytes),
+        "float32_samples_per_sec": samples_per_second(reference, X),
+        "int8_samples_per_sec": samples_per_second(quantized, X),
+    }
+
+
+def main():
+    """
+    Calibrates a saved network on a data set sample, and prints the
+    accuracy report of the int8 network on the test set.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("model", help="path of the network checkpoint")
+    parser.add_argument("--data", choices=("mnist", "cifar10"),
+                        default="mnist")
+    parser.add_argument("--samples", type=int, default=1000,
+                        help="size of the calibration sample")
+    parser.add_argument("--percentile", type=float, default=100.0)
+    parser.add_argument("--json", action="store_true",
+                        help="print the report as JSON")
+    args = parser.parse_args()
+    from network import Network
+    network = Network.load(args.model)
+    X, _ = load_sample(args.data, CALIBRATION[args.data], args.samples)
+    quantized = quantize(network, X, args.percentile)
+    results = report(network, quantized,
+                     *load_sample(args.data, EVALUATION[args.data]))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(">> {} samples of {}".format(results["samples"], args.data))
+    print("   Accuracy: float {:.4f}, int8 {:.4f}, agreement {:.4f}".format(
+        results["float_accuracy"], results["int8_accuracy"],
+        results["agreement"]))
+    print("   Parameters: float32 {} bytes, int8 {} bytes".format(
+        results["float32_bytes"], results["int8_bytes"]))
+    print("   Samples/sec: float32 {:.0f}, int8 {:.0f}".format(
+        results["float32_samples_per_sec"], results["int8_samples_per_sec"]))
+
+
+if __name__ == "__main__":
+    main()
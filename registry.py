@@ -0,0 +1,110 @@
+"""
+Defines the registries of the layer, activation, loss, and optimizer types,
+which map names to classes. Entries can be registered as "module:Class"
+strings, so a module is only imported the first time its type is used.
+Third party packages can add types through entry points in the
+"mathai.layers", "mathai.activations", "mathai.losses", and
+"mathai.optimizers" groups, which are also resolved lazily.
+"""
+import importlib
+
+
+class Registry(object):
+    """
+    Registry class mapping names to the classes of a single kind of type.
+    """
+
+    def __init__(self, kind, group):
+        self.kind = kind
+        self.group = group
+        self.entries = {}
+        self.plugins_loaded = False
+
+    def __repr__(self):
+        return "<Registry.{} {}>".format(self.kind, sorted(self.entries))
+
+    def __contains__(self, name):
+        self.load_plugins()
+        return name in self.entries
+
+    def register(self, name, target=None):
+        """
+        Registers target under name. Target is either a class, or a
+        "module:Class" string that is imported on first use. Without a
+        target this returns a class decorator instead.
+        """
+        if target is None:
+
+            def decorator(cls):
+                self.entries[name] = cls
+                return cls
+
+            return decorator
+        self.entries[name] = target
+        return target
+
+    def load_plugins(self):
+        """
+        Registers the entry points of the group, without importing them.
+        """
+        if self.plugins_loaded:
+            return
+        self.plugins_loaded = True
+        try:
+            from importlib.metadata import entry_points
+        except ImportError:
+            # Python 3.7 has no importlib.metadata, so there are no plugins
+            return
+        try:
+            plugins = entry_points(group=self.group)
+        except TypeError:
+            # Before Python 3.10 entry_points takes no arguments, and returns
+            # a dict of the groups instead
+            plugins = entry_points().get(self.group, [])
+        for plugin in plugins:
+            self.entries.setdefault(plugin.name, plugin.value)
+
+    def get(self, name):
+        """
+        Returns the class registered under name, importing it if needed.
+        """
+        if name not in self.entries:
+            self.load_plugins()
+        if name not in self.entries:
+            raise KeyError("Unknown {} type {!r}".format(self.kind, name))
+        target = self.entries[name]
+        if isinstance(target, str):
+            module, _, attr = target.partition(":")
+            target = importlib.import_module(module)
+            for part in attr.split("."):
+                target = getattr(target, part)
+            self.entries[name] = target
+        return target
+
+    def name_of(self, cls):
+        """
+        Returns the name a class is registered under, without importing any
+        of the other entries.
+        """
+        path = "{}:{}".format(cls.__module__, cls.__qualname__)
+        for name, target in self.entries.items():
+            if target is cls or target == path:
+                return name
+        raise KeyError("{} is not a registered {} type".format(
+            cls.__name__, self.kind))
+
+
+layers = Registry("layer", "mathai.layers")
+activations = Registry("activation", "mathai.activations")
+losses = Registry("loss", "mathai.losses")
+optimizers = Registry("optimizer", "mathai.optimizers")
+
+layers.register("input", "layer.input:Input")
+layers.register("dense", "layer.dense:Dense")
+layers.register("conv2d", "layer.conv2d:Conv2D")
+layers.register("maxpool", "layer.maxpool:MaxPool")
+activations.register("relu", "activation.relu:ReLU")
+activations.register("sigmoid", "activation.sigmoid:Sigmoid")
+losses.register("softmax", "loss.softmax:Softmax")
+optimizers.register("sgd", "optimizer.sgd:SGD")
+optimizers.register("adam", "optimizer.adam:Adam")
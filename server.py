@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Prediction server for a trained network. Requests are coalesced into
+micro-batches, so concurrent single sample requests share one batched
+forward propagation.
+
+Start it with the path to a checkpoint saved with Network.save:
+
+    ./server.py model.nn --port 8000
+
+Then POST JSON to /predict, either {"input": [...]} for a single sample or
+{"inputs": [[...], ...]} for several, and GET /stats for the latency and
+batch size statistics.
+"""
+import argparse
+import collections
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from network import Network
+
+
+class Request(object):
+    """
+    A pending prediction, which is completed by the batcher thread.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.result = None
+        self.error = None
+        self.start = time.perf_counter()
+        self.done = threading.Event()
+
+
+class LatencyStats(object):
+    """
+    Keeps the latencies of the most recent requests, and a histogram of the
+    sizes of the micro-batches.
+    """
+
+    def __init__(self, window=10000):
+        self.latencies = collections.deque(maxlen=window)
+        self.batch_sizes = collections.Counter()
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def record(self, latencies, batch_size):
+        with self.lock:
+            self.latencies.extend(latencies)
+            self.batch_sizes[batch_size] += 1
+            self.requests += len(latencies)
+
+    def report(self):
+        """
+        :returns: Dict with the request count, the p50 and p99 latencies in
+                  milliseconds, and the number of batches of every size.
+        """
+        with self.lock:
+            latencies = np.array(self.latencies)
+            sizes = dict(sorted(self.batch_sizes.items()))
+            requests = self.requests
+        p50, p99 = (np.percentile(latencies, [50, 99]) * 1000.0
+                    if latencies.size else (0.0, 0.0))
+        return {
+            "requests": requests,
+            "p50_ms": float(p50),
+            "p99_ms": float(p99),
+            "batch_sizes": sizes
+        }
+
+
+class MicroBatcher(object):
+    """
+    Collects the requests from many threads, and runs them through the
+    network in batches on a single worker thread. A batch is started by the
+    first waiting request, and is closed once it holds max_batch samples or
+    that request has waited max_delay seconds.
+
+    Every request is checked against the input shape of the network before
+    it is queued, so a malformed request doesn't fail the batch it would
+    have joined.
+    """
+
+    def __init__(self, network, max_batch=64, max_delay=0.005):
+        self.network = network
+        shape = network.layers[0].shape
+        self.shape = None if shape is None else tuple(
+            int(size) for size in np.atleast_1d(shape))
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.requests = queue.Queue()
+        self.stats = LatencyStats()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def predict(self, X):
+        """
+        Queues X for the next micro-batch, and waits for the result.
+
+        :param X: A single sample, or a batch of samples.
+        :returns: The probabilities if the network has a softmax loss,
+                  otherwise the scores.
+        :raises ValueError: If the samples don't have the input shape of the
+                            network.
+        """
+        data = np.asarray(X, dtype=self.network.dtype)
+        shape = self.shape if self.shape is not None else data.shape[-1:]
+        single = data.ndim == len(shape)
+        if data.shape[data.ndim - len(shape):] != shape or data.ndim not in (
+                len(shape), len(shape) + 1):
+            raise ValueError("Expected samples of shape {}, got {}".format(
+                shape, data.shape))
+        request = Request(data.reshape((-1, ) + shape))
+        self.requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result[0] if single else request.result
+
+    def close(self):
+        self.requests.put(None)
+        self.worker.join()
+
+    def collect(self, first):
+        """
+        Gathers the requests of the batch started by first.
+        """
+        batch = [first]
+        size = len(first.data)
+        deadline = first.start + self.max_delay
+        while size < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                self.requests.put(None)
+                break
+            batch.append(request)
+            size += len(request.data)
+        return batch, size
+
+    def run(self):
+        context = {}
+        probabilities = getattr(self.network.loss_function, 'probabilities',
+                                None)
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            batch, size = self.collect(request)
+            try:
+                scores = self.network.forward(
+                    np.concatenate([req.data for req in batch]), context)
+                if probabilities is not None:
+                    scores = probabilities(scores)
+                else:
+                    scores = scores.copy()
+                start = 0
+                for req in batch:
+                    req.result = scores[start:start + len(req.data)]
+                    start += len(req.data)
+            except Exception as err:
+                for req in batch:
+                    req.error = err
+            end = time.perf_counter()
+            for req in batch:
+                req.done.set()
+            self.stats.record([end - req.start for req in batch], size)
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """
+    HTTP front end of the micro-batcher, the batcher is found on the server.
+    """
+
+    def send_json(self, code, body):
+        payload = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path != "/stats":
+            self.send_json(404, {"error": "unknown path"})
+            return
+        self.send_json(200, self.server.batcher.stats.report())
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self.send_json(404, {"error": "unknown path"})
+            return
+        try:
+            body = json.loads(self.rfile.read(
+                int(self.headers.get("Content-Length", 0))))
+            data = body["input"] if "input" in body else body["inputs"]
+            probs = self.server.batcher.predict(data)
+        except (ValueError, KeyError, TypeError) as err:
+            self.send_json(400, {"error": str(err)})
+            return
+        except Exception as err:
+            self.send_json(500, {"error": "{}: {}".format(
+                type(err).__name__, err)})
+            return
+        self.send_json(200, {
+            "outputs": probs.tolist(),
+            "labels": np.argmax(probs, axis=-1).tolist()
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PredictionServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server holding the micro-batcher, with a listen backlog
+    large enough for bursts of concurrent requests.
+    """
+    request_queue_size = 128
+    daemon_threads = True
+
+    def __init__(self, address, batcher):
+        super().__init__(address, PredictionHandler)
+        self.batcher = batcher
+
+
+def main():
+    """
+    Function that is called on startup of the prediction server
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("model", help="path of the network checkpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument(
+        "--max-delay-ms",
+        type=float,
+        default=5.0,
+        help="latency budget for filling a micro-batch")
+    args = parser.parse_args()
+    network = Network.load(args.model)
+    batcher = MicroBatcher(network, args.max_batch, args.max_delay_ms / 1000.0)
+    server = PredictionServer((args.host, args.port), batcher)
+    print(">> Serving on http://{}:{}".format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    batcher.close()
+    print("   {}".format(batcher.stats.report()))
+
+
+if __name__ == "__main__":
+    main()
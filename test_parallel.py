@@ -0,0 +1,66 @@
+"""
+Regression tests of the parallel trainers, run with python -m pytest or
+python -m unittest
+"""
+import unittest
+
+import numpy as np
+
+import loss
+import optimizer
+from network import Network
+
+
+def small_network():
+    """
+    :returns: Network small enough to train in a few milliseconds.
+    """
+    np.random.seed(1)
+    nn = Network(loss_function=loss.softmax.Softmax())
+    nn.add_layer(Network.INPUT, shape=30)
+    nn.add_layer(Network.DENSE,
+                 neurons=32,
+                 activation=Network.RELU,
+                 bias_init=0.1)
+    nn.add_layer(Network.DENSE, neurons=4)
+    return nn
+
+
+class DataParallelTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.X = rng.normal(size=(512, 30))
+        self.Y = (self.X @ rng.normal(size=(30, 4))).argmax(axis=1)
+
+    def test_matches_serial(self):
+        for workers in [2, 3]:
+            serial = small_network()
+            parallel = small_network()
+            np.random.seed(5)
+            expected = serial.fit(self.X,
+                                  self.Y,
+                                  epochs=2,
+                                  batch_size=64,
+                                  optimizer=optimizer.sgd.SGD(0.1, 0.9))
+            np.random.seed(5)
+            history = parallel.fit(self.X,
+                                   self.Y,
+                                   epochs=2,
+                                   batch_size=64,
+                                   optimizer=optimizer.sgd.SGD(0.1, 0.9),
+                                   workers=workers)
+            np.testing.assert_allclose(history, expected, rtol=1e-12)
+            for lay, ref in zip(parallel.layers[1:], serial.layers[1:]):
+                np.testing.assert_allclose(lay.weights,
+                                           ref.weights,
+                                           rtol=1e-12,
+                                           atol=1e-15)
+                np.testing.assert_allclose(lay.bias,
+                                           ref.bias,
+                                           rtol=1e-12,
+                                           atol=1e-15)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+Regression tests of the compiled plans, run with python -m pytest or
+python -m unittest
+"""
+import unittest
+
+import numpy as np
+
+import loss
+from network import Network
+
+
+def deep_network():
+    """
+    :returns: Network of six hidden dense layers, deep enough for the
+              checkpoints to split it into several segments.
+    """
+    np.random.seed(1)
+    nn = Network(loss_function=loss.softmax.Softmax())
+    nn.add_layer(Network.INPUT, shape=20)
+    for index, activation in enumerate(
+        ["relu", "sigmoid", "relu", "relu", "sigmoid", "relu"]):
+        nn.add_layer(Network.DENSE,
+                     neurons=16 + 3 * index,
+                     bias_init=0.1,
+                     activation=activation)
+    nn.add_layer(Network.DENSE, neurons=5)
+    return nn
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.X = rng.normal(size=(64, 20))
+        self.Y = rng.randint(0, 5, size=64)
+
+    def gradients(self, checkpoints):
+        """
+        :returns: The summed weight and bias gradients of a single batch.
+        """
+        nn = deep_network()
+        plan = nn.compile(64, checkpoints=checkpoints)
+        loss_function = nn.loss_function
+        loss_function.forward_prop(plan.forward(self.X), self.Y)
+        plan.backward(loss_function.backward_prop())
+        return [(lay.grad_weights.copy(), lay.grad_bias.copy())
+                for lay in nn.layers[1:]]
+
+    def test_gradients_match_recursive(self):
+        nn = deep_network()
+        nn.layers[0].load_data(self.X)
+        nn.loss_function.forward_prop(nn.layers[-1].forward_prop(), self.Y)
+        nn.layers[-1].backward_prop(nn.loss_function.backward_prop())
+        for checkpoints in [None, [2], [1, 3], [2, 4, 5]]:
+            for (weights, bias), lay in zip(self.gradients(checkpoints),
+                                            nn.layers[1:]):
+                np.testing.assert_allclose(weights,
+                                           lay.grad_weights,
+                                           rtol=1e-12,
+                                           atol=1e-15,
+                                           err_msg=str(checkpoints))
+                np.testing.assert_allclose(bias,
+                                           lay.grad_bias,
+                                           rtol=1e-12,
+                                           atol=1e-15,
+                                           err_msg=str(checkpoints))
+
+    def test_training_matches_recursive(self):
+        reference = deep_network()
+        np.random.seed(3)
+        expected = reference.fit(self.X, self.Y, epochs=2, batch_size=16)
+        for checkpoints in [None, [2], [1, 3], [2, 4, 5]]:
+            nn = deep_network()
+            nn.compile(16, checkpoints=checkpoints)
+            np.random.seed(3)
+            history = nn.fit(self.X, self.Y, epochs=2, batch_size=16)
+            np.testing.assert_allclose(history, expected, rtol=1e-12)
+            for lay, ref in zip(nn.layers[1:], reference.layers[1:]):
+                np.testing.assert_allclose(lay.weights,
+                                           ref.weights,
+                                           rtol=1e-12,
+                                           atol=1e-15)
+
+    def test_batch_growth_rebuilds(self):
+        nn = deep_network()
+        plan = nn.compile(8, checkpoints=[2, 4])
+        plan.forward(self.X)
+        self.assertEqual(plan.batch_size, 64)
+        self.assertEqual(plan.checkpoints, [2, 4])
+        np.testing.assert_allclose(plan.forward(self.X),
+                                   deep_network().predict(self.X),
+                                   rtol=1e-12)
+
+
+if __name__ == "__main__":
+    unittest.main()